@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+
+# ------------------------------------------------------------------------- #
+# Dependency imports
+# ------------------------------------------------------------------------- #
+
+import hashlib
+import logging
+import os
+import sqlite3
+import time
+import zlib
+
+from state import hash_file
+from store import SQLiteStore
+
+# ------------------------------------------------------------------------- #
+# Globals / Defaults
+# ------------------------------------------------------------------------- #
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (
+    sha TEXT PRIMARY KEY,
+    data BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS entries (
+    id INTEGER PRIMARY KEY,
+    run TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    input TEXT NOT NULL,
+    output TEXT NOT NULL,
+    time REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_filename ON entries (filename);
+CREATE INDEX IF NOT EXISTS entries_run ON entries (run);
+CREATE INDEX IF NOT EXISTS entries_output ON entries (output);
+"""
+
+READ_SIZE = 1 << 20  # bytes read and compressed at once
+
+# ------------------------------------------------------------------------- #
+# Util functions
+# ------------------------------------------------------------------------- #
+
+
+def compress_file(filename, sha):
+    """Returns the zlib compressed content of a file. Raises OSError if
+    it no longer has the sha256 hex digest sha, e.g. it was rewritten.
+    """
+    h, z, parts = hashlib.sha256(), zlib.compressobj(9), []
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(READ_SIZE), b""):
+            h.update(chunk)
+            parts.append(z.compress(chunk))
+    parts.append(z.flush())
+    if h.hexdigest() != sha:
+        raise OSError(f"{filename} changed while it was archived")
+    return b"".join(parts)
+
+
+def below(filename, folder):
+    """True if folder is None or the file is below it"""
+    return folder is None or filename.startswith(folder.rstrip(os.sep) + os.sep)
+
+# ------------------------------------------------------------------------- #
+# Archive
+# ------------------------------------------------------------------------- #
+
+
+class Archive(SQLiteStore):
+    """Originals of all exports the proxy changed, in SQLite.
+
+    Contents are stored once per sha256, zlib compressed. Every change
+    is an entry with the run, the file, the hash of its content before
+    and after the run. Originals are added when a file is written and
+    recorded once it replaced the file, so failed writes leave no entry.
+    """
+
+    schema = SCHEMA
+
+    def __init__(self, filename, run=None):
+        super().__init__(filename)
+        self.run = run  # id of the current run
+        self.pending = {}  # filename -> sha of the original
+
+    def add(self, filename, raw=None):
+        """Stores the content of a file before it is replaced, raw if
+        it was read already. Content that is stored already is not
+        compressed again. Raises OSError if it cannot be stored, the
+        file must not be changed then.
+        """
+        sha = hashlib.sha256(raw).hexdigest() if raw is not None else hash_file(filename, READ_SIZE)
+        try:
+            db = self.connect()
+            if db.execute("SELECT 1 FROM blobs WHERE sha = ?", (sha,)).fetchone() is None:
+                data = zlib.compress(raw, 9) if raw is not None else compress_file(filename, sha)
+                db.execute("INSERT OR IGNORE INTO blobs VALUES (?, ?)", (sha, data))
+        except sqlite3.Error as e:
+            raise OSError(f"cannot archive original in {self.filename}: {e}") from e
+        self.pending[str(filename)] = sha
+
+    def record(self, filename, output):
+        """Records the change of a file, once output replaced it"""
+        sha = self.pending.pop(str(filename), None)
+        if sha is None:
+            return
+        try:
+            self.connect().execute(
+                "INSERT INTO entries (run, filename, input, output, time) VALUES (?, ?, ?, ?, ?)",
+                (self.run, str(filename), sha, output, time.time()),
+            )
+        except sqlite3.Error as e:
+            logging.error("Cannot record the original of %s in %s: %s", filename, self.filename, e)
+
+    def discard(self, filename):
+        self.pending.pop(str(filename), None)
+
+    def read(self, sha):
+        row = self.connect().execute("SELECT data FROM blobs WHERE sha = ?", (sha,)).fetchone()
+        return zlib.decompress(row[0])
+
+    def runs(self):
+        """Returns (run, files, started) of all runs, oldest first"""
+        return self.connect().execute(
+            "SELECT run, COUNT(*), MIN(time) FROM entries GROUP BY run ORDER BY MIN(time)"
+        ).fetchall()
+
+    def originals(self, run=None, folder=None):
+        """Returns (filename, input, output) of the entries to restore.
+
+        For a run, these are the files as they were before the run.
+        Otherwise the last version of each file Dataverse wrote, i.e.
+        content the proxy did not produce itself. Both optionally only
+        of the files below folder.
+        """
+        db = self.connect()
+        if run is not None:
+            entries = db.execute(
+                "SELECT filename, input, output FROM entries WHERE run = ? ORDER BY id", (run,)
+            )
+            return [e for e in entries if below(e[0], folder)]
+
+        latest = {}  # filename -> output of the last change
+        for filename, output in db.execute("SELECT filename, output FROM entries ORDER BY id"):
+            latest[filename] = output
+        entries = db.execute(
+            "SELECT filename, input FROM entries"
+            " WHERE input NOT IN (SELECT output FROM entries) ORDER BY id"
+        )
+        restore = {}
+        for filename, sha in entries:
+            if below(filename, folder):
+                restore[filename] = sha
+        return [(f, sha, latest[f]) for f, sha in sorted(restore.items())]
+
+    def __getstate__(self):
+        return {**super().__getstate__(), "pending": {}}
+
+
+def new_run_id():
+    """Unique per run, also for the runs of one process in watch mode"""
+    now = time.time()
+    return time.strftime("%Y%m%dT%H%M%S", time.localtime(now)) + f".{int(now * 1e6) % 10**6:06d}-{os.getpid()}"
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+
+# ------------------------------------------------------------------------- #
+# Dependency imports
+# ------------------------------------------------------------------------- #
+
+import os
+import time
+
+# ------------------------------------------------------------------------- #
+# Globals / Defaults
+# ------------------------------------------------------------------------- #
+
+MB = 1 << 20
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+class BudgetExceeded(Exception):
+    """A file took more time or memory than its budget allows"""
+
+
+# ------------------------------------------------------------------------- #
+# Util functions
+# ------------------------------------------------------------------------- #
+
+
+def rss():
+    """Resident memory of this process in bytes, None if unknown"""
+    try:
+        with open("/proc/self/statm", "rb") as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None  # not Linux, memory budgets are not checked
+
+
+# ------------------------------------------------------------------------- #
+# Budget
+# ------------------------------------------------------------------------- #
+
+
+class Budget:
+    """Wall-clock, memory and size limits of processing a single file,
+    0 disables a limit. Files larger than max_mb are not read at all.
+    Time and memory are checked between the steps of the processing,
+    so a file is stopped at the next check once it went over budget.
+    The time after every rule, the memory, which costs more to read,
+    only after parsing, the rules and serializing. The hardened parser
+    keeps the single steps bounded.
+
+    Memory is the growth of the process' resident memory since start.
+    Everything else the process allocates meanwhile counts as well,
+    e.g. the exports I/O threads read ahead.
+    """
+
+    def __init__(self, seconds=0, memory_mb=0, max_mb=0):
+        self.seconds = seconds
+        self.memory = memory_mb * MB
+        self.max_bytes = max_mb * MB
+        self.deadline = None
+        self.base = None
+
+    def check_size(self, size):
+        """Raises BudgetExceeded if a file of size bytes is too large"""
+        if self.max_bytes and size > self.max_bytes:
+            raise BudgetExceeded(f"{size / MB:.1f} MB, larger than {self.max_bytes / MB:g} MB")
+
+    def start(self):
+        """Starts the budget of a file"""
+        self.deadline = time.perf_counter() + self.seconds if self.seconds else None
+        self.base = rss() if self.memory else None
+
+    def check(self, step, memory=True):
+        """Raises BudgetExceeded if the file is over budget after step,
+        its memory is only checked if memory is true.
+        """
+        if self.deadline is not None and time.perf_counter() > self.deadline:
+            raise BudgetExceeded(f"took more than {self.seconds:g}s, stopped after {step}")
+        if memory and self.base is not None:
+            used = (rss() or self.base) - self.base
+            if used > self.memory:
+                raise BudgetExceeded(
+                    f"used {used / MB:.0f} MB, more than {self.memory / MB:g} MB, stopped after {step}"
+                )
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+
+# ------------------------------------------------------------------------- #
+# Dependency imports
+# ------------------------------------------------------------------------- #
+
+import json
+import logging
+import sqlite3
+import time
+import zlib
+
+from store import SQLiteStore
+
+# ------------------------------------------------------------------------- #
+# Globals / Defaults
+# ------------------------------------------------------------------------- #
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS transforms (
+    key TEXT PRIMARY KEY,
+    output BLOB,
+    meta TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    used REAL NOT NULL
+)
+"""
+
+EVICT_TO = 0.9  # share of the maximum size left after an eviction
+
+# ------------------------------------------------------------------------- #
+# Transform cache
+# ------------------------------------------------------------------------- #
+
+
+class TransformCache(SQLiteStore):
+    """Content-addressed store of transformed exports in SQLite.
+
+    Maps the hash of a raw export, its format and the version of the
+    active rules to the transformed bytes, zlib compressed, and a json
+    object with the rules that fired and the violations. Output is None for exports
+    the rules do not change. The least recently used entries are
+    evicted once the store grows beyond max_bytes.
+    """
+
+    schema = SCHEMA
+
+    def __init__(self, filename, max_bytes, version=""):
+        super().__init__(filename)
+        self.max_bytes = max_bytes
+        self.version = version  # of the rules, changes all keys
+        self.total = 0  # estimate, other processes write as well
+        self.failed = False  # e.g. not writable, the cache is not used then
+
+    def connected(self):
+        self.total = self.size()
+
+    def size(self):
+        return self.db.execute("SELECT COALESCE(SUM(size), 0) FROM transforms").fetchone()[0]
+
+    def key(self, digest, fmt=""):
+        """Key of an export by the sha256 hex digest of its content"""
+        return ":".join((digest, fmt, self.version))
+
+    def get(self, key):
+        """Returns (output, meta) of a transformed export or None"""
+        if self.failed:
+            return None
+        try:
+            db = self.connect()
+            row = db.execute("SELECT output, meta FROM transforms WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            db.execute("UPDATE transforms SET used = ? WHERE key = ?", (time.time(), key))
+        except sqlite3.Error as e:
+            self.fail(e)
+            return None
+        output, meta = row
+        return (zlib.decompress(output) if output is not None else None), json.loads(meta)
+
+    def put(self, key, output, meta):
+        blob = zlib.compress(output) if output is not None else None
+        meta = json.dumps(meta, separators=(",", ":"))
+        size = len(blob or b"") + len(meta)
+        if self.failed or size > self.max_bytes:
+            return
+        try:
+            db = self.connect()
+            db.execute(
+                "INSERT OR REPLACE INTO transforms VALUES (?, ?, ?, ?, ?)",
+                (key, blob, meta, size, time.time()),
+            )
+            self.total += size
+            if self.total > self.max_bytes:
+                self.evict()
+        except sqlite3.Error as e:
+            self.fail(e)
+
+    def fail(self, e):
+        logging.warning("Transform cache %s unavailable, not using it: %s", self.filename, e)
+        self.failed = True
+
+    def evict(self):
+        """Removes the least recently used entries until the cache is
+        below EVICT_TO of its maximum size.
+        """
+        self.total = self.size()
+        target = self.max_bytes * EVICT_TO
+        if self.total <= target:
+            return
+        doomed = []
+        for key, size in self.db.execute("SELECT key, size FROM transforms ORDER BY used").fetchall():
+            if self.total <= target:
+                break
+            doomed.append((key,))
+            self.total -= size
+        self.db.executemany("DELETE FROM transforms WHERE key = ?", doomed)
+        logging.info("Evicted %s exports from the transform cache", len(doomed))
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+
+# ------------------------------------------------------------------------- #
+# Dependency imports
+# ------------------------------------------------------------------------- #
+
+import json
+import os
+
+from collections import Counter, namedtuple
+from functools import lru_cache
+
+from lxml import etree
+
+import ddi_profile
+from writer import write_atomic
+
+# ------------------------------------------------------------------------- #
+# Globals / Defaults
+# ------------------------------------------------------------------------- #
+
+# Namespaces as declared in the profile's pr:XMLPrefixMap
+NSMAP = {
+    "ddi": "ddi:codebook:2_5",
+    "xml": "http://www.w3.org/XML/1998/namespace",
+    "xsi": "http://www.w3.org/2001/XMLSchema-instance",
+}
+
+LEVELS = ("Mandatory", "Recommended")  # constraints that are checked
+
+MISSING = "missing"
+EMPTY = "empty"
+
+# A rule of the profile an export does not meet
+Violation = namedtuple("Violation", "xpath level problem")
+
+# ------------------------------------------------------------------------- #
+# Validator
+# ------------------------------------------------------------------------- #
+
+
+class Check:
+    """A pr:Used rule compiled into lxml XPath objects. Rules with a
+    condition, e.g. "Mandatory if parent is present", are only checked
+    where the parent element exists.
+    """
+
+    def __init__(self, xpath, constraint):
+        self.xpath = xpath
+        self.level = constraint.split()[0]
+        self.conditional = " if " in constraint
+
+        element, _, attrib = xpath.partition("/@")
+        steps = ["ddi:" + s for s in element.strip("/").split("/")]
+        self.find = etree.XPath("//" + "/".join(steps), namespaces=NSMAP)
+        self.find_parent = None  # the codeBook itself has no parent
+        if len(steps) > 1:
+            self.find_parent = etree.XPath("//" + "/".join(steps[:-1]), namespaces=NSMAP)
+        self.qname = None
+        if attrib:
+            ns, _, name = attrib.rpartition(":")
+            self.qname = "{" + NSMAP[ns] + "}" + name if ns else name
+
+    def run(self, xml):
+        """Returns the problem of the document with this rule, or None"""
+        found = self.find(xml)
+        if self.qname is None:
+            if not found:
+                if self.conditional and self.find_parent and not self.find_parent(xml):
+                    return None
+                return MISSING
+            if not any(has_content(el) for el in found):
+                return EMPTY
+            return None
+
+        # Attributes are conditional on their element if the rule says so
+        if not found:
+            return None if self.conditional else MISSING
+        values = [el.get(self.qname) for el in found]
+        if any(v is None for v in values):
+            return MISSING
+        if any(not v.strip() for v in values):
+            return EMPTY
+        return None
+
+
+def has_content(el):
+    return bool(el.text and el.text.strip()) or len(el) > 0
+
+
+class Validator:
+    """Checks parsed exports against the mandatory and recommended
+    rules of a CESSDA DDI profile.
+    """
+
+    def __init__(self, rules, levels=LEVELS):
+        self.checks = [
+            Check(xpath, rule["constraint"])
+            for xpath, rule in rules.items()
+            if rule["constraint"].split()[0] in levels
+        ]
+
+    def validate(self, xml, skip=()):
+        """Returns the Violations of a parsed export. Rules pointing
+        into one of the skipped sections, e.g. ones that were not
+        parsed, are not checked.
+        """
+        violations = []
+        for check in self.checks:
+            if any(check.xpath.startswith(f"/codeBook/{s}") for s in skip):
+                continue
+            problem = check.run(xml)
+            if problem is not None:
+                violations.append(Violation(check.xpath, check.level, problem))
+        return violations
+
+
+@lru_cache(maxsize=None)
+def load(profile):
+    """Returns the Validator of a profile, compiled once per process.
+    Without a profile nothing is checked.
+    """
+    if not os.path.exists(profile):
+        return Validator({})
+    return Validator(ddi_profile.load(profile))
+
+
+def compliant(violations):
+    return not any(v.level == "Mandatory" for v in violations)
+
+
+# ------------------------------------------------------------------------- #
+# Report
+# ------------------------------------------------------------------------- #
+
+
+class Report:
+    """Compliance of all files of a run"""
+
+    def __init__(self):
+        self.files = {}  # filename -> violations
+        self.checked = 0
+        self.compliant = 0
+        self.rules = Counter()  # (xpath, level, problem) -> files
+
+    def add(self, filename, violations):
+        self.checked += 1
+        self.compliant += compliant(violations)
+        if violations:
+            self.files[str(filename)] = violations
+            self.rules.update(violations)
+
+    def summary(self):
+        return {
+            "checked": self.checked,
+            "compliant": self.compliant,
+            "rules": [
+                {**v._asdict(), "files": n} for v, n in self.rules.most_common()
+            ],
+            "files": {
+                f: [v._asdict() for v in violations] for f, violations in sorted(self.files.items())
+            },
+        }
+
+    def write(self, filename):
+        write_atomic(filename, json.dumps(self.summary(), indent=2))
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+
+# ------------------------------------------------------------------------- #
+# Dependency imports
+# ------------------------------------------------------------------------- #
+
+import hashlib
+import json
+import logging
+import os
+
+import ddi_profile
+
+# ------------------------------------------------------------------------- #
+# Globals / Defaults
+# ------------------------------------------------------------------------- #
+
+# Attributes DDI allows on every element, even if the profile does not list them
+ANY_ELEMENT = ("@xml:lang",)
+
+
+class ConfigError(Exception):
+    """The configuration cannot be read or contains invalid rules"""
+
+
+# ------------------------------------------------------------------------- #
+# Util functions
+# ------------------------------------------------------------------------- #
+
+
+def read_json(filename):
+    try:
+        with open(filename, encoding="utf-8") as f:
+            data = json.load(f)
+    except OSError as e:
+        raise ConfigError(f"Cannot read {filename}: {e.strerror}") from e
+    except ValueError as e:
+        raise ConfigError(f"Invalid json in {filename}: {e}") from e
+    if not isinstance(data, dict):
+        raise ConfigError(f"{filename} must contain a json object")
+    return data
+
+
+def in_profile(rule, paths):
+    if rule in paths:
+        return True
+    element, _, attribute = rule.rpartition("/")
+    return "@" + attribute.lstrip("@") in ANY_ELEMENT and element in paths
+
+
+def validate(defaults, hooks, paths=None, root="/codeBook"):
+    """Raises ConfigError listing every invalid rule. Rules must start
+    at the root element of their format and, with the paths of a
+    profile, point to an element or attribute of it.
+    """
+    errors = []
+    for rule, value in defaults.items():
+        if rule != root and not rule.startswith(root + "/"):
+            errors.append(f"{rule}: must start with {root}")
+        elif paths is not None and not in_profile(rule, paths):
+            errors.append(f"{rule}: not part of the profile")
+        if not isinstance(value, str):
+            errors.append(f"{rule}: default value must be a string")
+    for rule, names in hooks.items():
+        names = [names] if isinstance(names, str) else names
+        if not isinstance(names, list) or not all(isinstance(n, str) for n in names):
+            errors.append(f"{rule}: hooks must be a name or a list of names")
+    if errors:
+        raise ConfigError("Invalid rules: " + "; ".join(errors))
+
+
+# ------------------------------------------------------------------------- #
+# Configuration
+# ------------------------------------------------------------------------- #
+
+
+class Config:
+    """The defaults and hooks files, validated against the profile and
+    compiled once. They are only read again if they change on disk.
+    An invalid edit is logged and the previous rules are kept, so a
+    long running proxy never stops because of a typo.
+
+    compile(defaults, hooks) turns the parsed files into rules and
+    raises ConfigError if it cannot. Formats without special cases or
+    profile pass None for hooks or profile.
+    """
+
+    def __init__(self, defaults, hooks, profile, compile, root="/codeBook"):
+        self.defaults = str(defaults)
+        self.hooks = str(hooks) if hooks is not None else None
+        self.compile = compile
+        self.root = root
+        self.paths = None
+        if profile is not None and os.path.exists(profile):
+            self.paths = ddi_profile.element_paths(ddi_profile.load(profile))
+        elif profile is not None:
+            logging.warning("No profile %s, rules are not validated", profile)
+
+        self.stamp = None  # mtime and size of both files
+        self.hash = None  # of both files, recorded in the state manifest
+        self.data = None  # (defaults, hooks) as read from the files
+        self.rules = None
+        self.load()  # raises ConfigError
+
+    def files(self):
+        return [f for f in (self.defaults, self.hooks) if f is not None]
+
+    def stat(self):
+        stamp = []
+        for filename in self.files():
+            try:
+                st = os.stat(filename)
+                stamp.append((st.st_mtime_ns, st.st_size))
+            except FileNotFoundError:
+                stamp.append(None)
+        return stamp
+
+    def digest(self):
+        h = hashlib.sha256()
+        for filename in self.files():
+            try:
+                with open(filename, "rb") as f:
+                    h.update(f.read())
+            except FileNotFoundError:
+                pass
+            h.update(b"\0")
+        return h.hexdigest()
+
+    def load(self):
+        """Reads, validates and compiles both files unless their
+        content is unchanged. Returns True if the rules changed.
+        """
+        stamp, digest = self.stat(), self.digest()
+        if digest == self.hash:
+            self.stamp = stamp
+            return False
+
+        defaults = read_json(self.defaults)
+        hooks = {}
+        if self.hooks is not None and os.path.exists(self.hooks):
+            hooks = read_json(self.hooks)
+        elif self.hooks is not None:
+            logging.warning("No hooks file %s, special cases are disabled", self.hooks)
+        validate(defaults, hooks, self.paths, self.root)
+        rules = self.compile(defaults, hooks)
+
+        self.stamp, self.hash, self.data, self.rules = stamp, digest, (defaults, hooks), rules
+        logging.info("Loaded %s rules from %s", len(rules), self.defaults)
+        return True
+
+    def reload(self):
+        """Loads the files again if they changed on disk. Returns True
+        if the rules changed.
+        """
+        stamp = self.stat()
+        if stamp == self.stamp:
+            return False
+        try:
+            return self.load()
+        except ConfigError as e:
+            self.stamp = stamp  # not again until the next edit
+            logging.error("%s, keeping the previous rules", e)
+            return False
@@ -1,3 +1,9 @@
+import difflib
+import re
+import unicodedata
+
+from functools import lru_cache
+
 ISO3166 = {
 	'Andorra': 'AD',
 	'United Arab Emirates': 'AE',
@@ -244,4 +250,171 @@ ISO3166 = {
 	'Zaire': 'ZR',
 	'Zimbabwe': 'ZW',
 	'Unknown or unspecified country': 'ZZ',
-}
\ No newline at end of file
+}
+# Other names of countries, e.g. current short names and the German
+# names used in Austrian data. Keys are matched after normalize().
+ALIASES = {
+	'Czechia': 'CZ',
+	'Czech': 'CZ',
+	'UK': 'GB',
+	'Great Britain': 'GB',
+	'Britain': 'GB',
+	'England': 'GB',
+	'Scotland': 'GB',
+	'Wales': 'GB',
+	'Northern Ireland': 'GB',
+	'USA': 'US',
+	'US': 'US',
+	'United States': 'US',
+	'America': 'US',
+	'Russia': 'RU',
+	'Iran': 'IR',
+	'South Korea': 'KR',
+	'North Korea': 'KP',
+	'Laos': 'LA',
+	'Libya': 'LY',
+	'Moldova': 'MD',
+	'Syria': 'SY',
+	'Taiwan': 'TW',
+	'Tanzania': 'TZ',
+	'Vietnam': 'VN',
+	'Bahamas': 'BS',
+	'Ivory Coast': 'CI',
+	"Cote d'Ivoire": 'CI',
+	'Cook Islands': 'CK',
+	'Holy See': 'VA',
+	'Vatican': 'VA',
+	'Brunei': 'BN',
+	'Burma': 'MM',
+	'Myanmar': 'MM',
+	'Macedonia': 'MK',
+	'North Macedonia': 'MK',
+	'Serbia': 'RS',
+	'Montenegro': 'ME',
+	'Kosovo': 'XK',
+	'Turkiye': 'TR',
+	'The Netherlands': 'NL',
+	'Holland': 'NL',
+	'Republic of Ireland': 'IE',
+	# German
+	'Österreich': 'AT',
+	'Deutschland': 'DE',
+	'Bundesrepublik Deutschland': 'DE',
+	'Schweiz': 'CH',
+	'Liechtenstein': 'LI',
+	'Italien': 'IT',
+	'Frankreich': 'FR',
+	'Spanien': 'ES',
+	'Portugal': 'PT',
+	'Belgien': 'BE',
+	'Niederlande': 'NL',
+	'Luxemburg': 'LU',
+	'Dänemark': 'DK',
+	'Schweden': 'SE',
+	'Norwegen': 'NO',
+	'Finnland': 'FI',
+	'Island': 'IS',
+	'Irland': 'IE',
+	'Großbritannien': 'GB',
+	'Vereinigtes Königreich': 'GB',
+	'Griechenland': 'GR',
+	'Zypern': 'CY',
+	'Malta': 'MT',
+	'Polen': 'PL',
+	'Tschechien': 'CZ',
+	'Tschechische Republik': 'CZ',
+	'Slowakei': 'SK',
+	'Slowakische Republik': 'SK',
+	'Ungarn': 'HU',
+	'Slowenien': 'SI',
+	'Kroatien': 'HR',
+	'Bosnien und Herzegowina': 'BA',
+	'Serbien': 'RS',
+	'Nordmazedonien': 'MK',
+	'Mazedonien': 'MK',
+	'Albanien': 'AL',
+	'Rumänien': 'RO',
+	'Bulgarien': 'BG',
+	'Estland': 'EE',
+	'Lettland': 'LV',
+	'Litauen': 'LT',
+	'Weißrussland': 'BY',
+	'Belarus': 'BY',
+	'Ukraine': 'UA',
+	'Russland': 'RU',
+	'Türkei': 'TR',
+	'Vereinigte Staaten': 'US',
+	'Vereinigte Staaten von Amerika': 'US',
+	'Kanada': 'CA',
+	'Australien': 'AU',
+	'Japan': 'JP',
+	'China': 'CN',
+	'Indien': 'IN',
+	'Brasilien': 'BR',
+	'Südafrika': 'ZA',
+	'Ägypten': 'EG',
+	'Israel': 'IL',
+	'Syrien': 'SY',
+	'Afghanistan': 'AF',
+	'Irak': 'IQ',
+	'Tschechoslowakei': 'CS',
+	'Jugoslawien': 'YU',
+	'Sowjetunion': 'SU',
+	'DDR': 'DD',
+	'Deutsche Demokratische Republik': 'DD',
+}
+
+FUZZY_CUTOFF = 0.9  # minimum similarity of a fuzzy match
+MEMO_SIZE = 1024  # fuzzy lookups remembered per process
+
+# ------------------------------------------------------------------------- #
+# Resolver
+# ------------------------------------------------------------------------- #
+
+
+def normalize(name):
+    """Casefolded name without diacritics, punctuation and repeated
+    whitespace, e.g. 'Côte D'ivoire' -> 'cote d ivoire'.
+    """
+    name = unicodedata.normalize("NFKD", name.replace("ß", "ss"))
+    name = "".join(c for c in name if not unicodedata.combining(c))
+    name = re.sub(r"[^\w\s]|_", " ", name.casefold())
+    return " ".join(name.split())
+
+
+def build_index():
+    index = {}
+    for name, code in ISO3166.items():
+        index[normalize(name)] = code
+        # Also without remarks such as '(no longer exists)'
+        short = normalize(re.sub(r"\(.*?\)", "", name))
+        index.setdefault(short, code)
+    for name, code in ALIASES.items():
+        index.setdefault(normalize(name), code)
+    return index
+
+
+INDEX = build_index()  # normalized name -> code
+
+
+@lru_cache(maxsize=MEMO_SIZE)
+def fuzzy(key):
+    match = difflib.get_close_matches(key, INDEX.keys(), n=1, cutoff=FUZZY_CUTOFF)
+    return INDEX[match[0]] if match else None
+
+
+def resolve(name):
+    """Returns the ISO 3166 code of a country name, or None if it is
+    unknown. Exact names are looked up first, then the normalized
+    name and finally the closest similar name.
+    """
+    if name is None:
+        return None
+    code = ISO3166.get(name)
+    if code is not None:
+        return code
+    key = normalize(name)
+    if not key:
+        return None
+    code = INDEX.get(key)
+    return code if code is not None else fuzzy(key)
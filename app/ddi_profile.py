@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+
+# ------------------------------------------------------------------------- #
+# Dependency imports
+# ------------------------------------------------------------------------- #
+
+import json
+import os
+
+from pathlib import Path
+
+from lxml import etree
+
+from writer import write_atomic
+
+# ------------------------------------------------------------------------- #
+# Globals / Defaults
+# ------------------------------------------------------------------------- #
+
+NSMAP = {"pr": "ddi:ddiprofile:3_2", "r": "ddi:reusable:3_2"}
+
+# Keys of the profile's usage notes, e.g. "Required: Mandatory"
+FIELDS = {
+    "Required": "constraint",
+    "CDC UI Label": "ui_label",
+    "ElementType": "type",
+    "Usage": "usage",
+}
+
+CACHE_VERSION = 1  # bump if the format of a rule changes
+
+# ------------------------------------------------------------------------- #
+# Profile
+# ------------------------------------------------------------------------- #
+
+
+def parse(profile):
+    """Parses a CESSDA DDI profile into a dict of xpath -> rule. Every
+    rule holds its constraint, UI label, type and usage note, n/a if
+    the profile does not say.
+    """
+    parser = etree.XMLParser(
+        remove_blank_text=True, remove_comments=True, resolve_entities=False, no_network=True
+    )
+    xml = etree.parse(str(profile), parser)
+    rules = {}
+    for used in xml.iterfind(".//pr:Used", namespaces=NSMAP):
+        rule = dict.fromkeys(FIELDS.values(), "n/a")
+        for content in used.iterfind("r:Description/r:Content", namespaces=NSMAP):
+            key, sep, value = " ".join("".join(content.itertext()).split()).partition(": ")
+            if sep and key in FIELDS:
+                rule[FIELDS[key]] = value
+        rules[used.get("xpath")] = rule
+    return rules
+
+
+def cache_file(profile):
+    profile = Path(profile)
+    return profile.with_name(f".{profile.name}.json")
+
+
+def load(profile):
+    """Returns the rules of a profile. They are parsed once and kept in
+    a json file next to the profile until it is modified.
+    """
+    st = os.stat(profile)
+    stamp = [st.st_mtime_ns, st.st_size]
+    cache = cache_file(profile)
+    try:
+        with open(cache, encoding="utf-8") as f:
+            data = json.load(f)
+        if data["version"] == CACHE_VERSION and data["profile"] == stamp:
+            return data["rules"]
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+
+    rules = parse(profile)
+    try:
+        write_atomic(cache, json.dumps({"version": CACHE_VERSION, "profile": stamp, "rules": rules}))
+    except OSError:
+        pass  # e.g. read-only checkout, parse again next time
+    return rules
+
+
+def element_paths(rules):
+    """Returns the xpaths of all rules and of the elements above them"""
+    paths = set()
+    for xpath in rules:
+        paths.add(xpath)
+        steps = xpath.split("/@")[0].split("/")
+        for i in range(2, len(steps) + 1):
+            paths.add("/".join(steps[:i]))
+    return paths
+
+
+def with_constraint(rules, constraints):
+    """Yields the xpaths of all rules with one of the constraints, e.g.
+    Mandatory also yields "Mandatory if parent is present".
+    """
+    for xpath, rule in rules.items():
+        if any(rule["constraint"].startswith(c) for c in constraints):
+            yield xpath
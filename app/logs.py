@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+
+# ------------------------------------------------------------------------- #
+# Dependency imports
+# ------------------------------------------------------------------------- #
+
+import atexit
+import json
+import logging
+import logging.handlers
+import multiprocessing
+import queue
+
+from contextlib import contextmanager
+
+# ------------------------------------------------------------------------- #
+# Globals / Defaults
+# ------------------------------------------------------------------------- #
+
+FORMAT = "%(asctime)s::%(levelname)s::%(message)s"
+
+# Per-file summary records, one json object per processed file
+FILES = logging.getLogger("proxy.files")
+
+handlers = []  # handlers that write, owned by the listener thread
+listener = None
+
+# ------------------------------------------------------------------------- #
+# Setup
+# ------------------------------------------------------------------------- #
+
+
+def setup(filename, level=logging.INFO):
+    """Sends all log records to a queue. A listener thread takes them
+    from the queue and writes them to filename, so that processing
+    never waits for the log file.
+    """
+    global listener
+    stop()
+    handler = logging.FileHandler(filename, mode="a", encoding="utf-8")
+    handler.setFormatter(logging.Formatter(FORMAT))
+    handlers[:] = [handler]
+
+    q = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(q, *handlers, respect_handler_level=True)
+    listener.start()
+    use_queue(q, level)
+
+
+def use_queue(q, level):
+    """Replaces all handlers of the root logger by one that puts
+    records on q, e.g. in a worker process.
+    """
+    log = logging.getLogger()
+    for h in list(log.handlers):
+        log.removeHandler(h)
+    log.addHandler(logging.handlers.QueueHandler(q))
+    log.setLevel(level)
+
+
+def stop():
+    """Writes all queued records and stops the listener"""
+    global listener
+    if listener is not None:
+        listener.stop()
+        listener = None
+    for h in handlers:
+        h.close()
+
+
+atexit.register(stop)
+
+
+@contextmanager
+def worker_queue():
+    """Yields a queue for the records of worker processes. They are
+    written by a listener of the parent, so workers never share a
+    file handle.
+    """
+    q = multiprocessing.Queue()
+    worker_listener = logging.handlers.QueueListener(q, *handlers, respect_handler_level=True)
+    worker_listener.start()
+    try:
+        yield q
+    finally:
+        worker_listener.stop()
+        q.close()
+
+
+# ------------------------------------------------------------------------- #
+# Structured records
+# ------------------------------------------------------------------------- #
+
+
+def file_summary(filename, outcome, fired, seconds, violations=None):
+    """Logs the json summary record of a processed file"""
+    if FILES.isEnabledFor(logging.INFO):
+        FILES.info(json.dumps({
+            "file": str(filename),
+            "outcome": outcome,
+            "fired": fired,
+            "seconds": round(seconds, 6),
+            "violations": violations,
+        }, separators=(",", ":")))
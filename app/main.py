@@ -4,15 +4,36 @@
 # Dependency imports
 # ------------------------------------------------------------------------- #
 
-from country_codes import ISO3166 as cc
+from archive import Archive, new_run_id
+from budget import Budget, BudgetExceeded
+import compliance
+from cache import TransformCache
+from config import Config, ConfigError
+from country_codes import resolve as country_code
+import logs
+from metrics import Metrics
+from pipeline import DeferredWriter, Stage, prefetch
+from state import Lock, Manifest, Quarantine, file_state
+from stream import SECTIONS, join, placeholders_ok, split, streamable
+from server import Proxy, serve
+from watch import debounced, watcher
+from writer import AtomicWriter
 
-import json
+import argparse
+import difflib
+import hashlib
 import logging
 import os
+import signal
 import sys
 import shutil
+import time
 
+from collections import Counter, deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import date, timedelta
+from functools import cached_property, partial
+from itertools import islice
 from pathlib import Path
 
 
@@ -24,42 +45,157 @@ from lxml import etree
 
 root = Path(__file__).parent.parent
 
-fmt = "%(asctime)s::%(levelname)s::%(message)s"
-logging.basicConfig(filename=root / "proxy.log", filemode="a", format=fmt, level=logging.INFO)
-
 FILE_ROOT = Path("/usr/local/payara6")  # default for payara6
 METADATA_ROOT = Path("/opt/data")  # path metadata files
 DEFAULTS = root / "assets/defaults.json"
+HOOKS = root / "assets/hooks.json"  # special cases per rule path
+LOG = root / "proxy.log"  # messages and per-file records of every run
+PROFILE = root / "assets/cdc25_profile_mono.xml"  # rules are validated against it
+ORIGINALS = root / "originals.sqlite"  # exports before the proxy changed them
+STATE = root / "state.json"  # per-file state of previous runs
+TRANSFORMS = root / "transforms.sqlite"  # transformed exports by content
+UPSTREAM = "http://localhost:8080/oai"  # Dataverse's OAI endpoint
 
 
 NSMAP = {
     "xlmns": "http://www.openarchives.org/OAI/2.0/",
     "ddi": "ddi:codebook:2_5",
     "xml": "http://www.w3.org/XML/1998/namespace",
-    "xsi": "http://www.openarchives.org/OAI/2.0/ http://www.openarchives.org/OAI/2.0/OAI-PMH.xsd",
+    "xsi": "http://www.w3.org/2001/XMLSchema-instance",
 }
 
+OAI_DC_NSMAP = {
+    "oai_dc": "http://www.openarchives.org/OAI/2.0/oai_dc/",
+    "dc": "http://purl.org/dc/elements/1.1/",
+    "xml": "http://www.w3.org/XML/1998/namespace",
+    "xsi": "http://www.w3.org/2001/XMLSchema-instance",
+}
+
+DCTERMS_NSMAP = {
+    "dcmi": "http://dublincore.org/documents/dcmi-terms/",  # default namespace of the export
+    "dcterms": "http://purl.org/dc/terms/",
+    "xml": "http://www.w3.org/XML/1998/namespace",
+    "xsi": "http://www.w3.org/2001/XMLSchema-instance",
+}
+
+# A metadata export Dataverse writes to every dataset folder. Its rules
+# start at the root element, steps without a prefix are in the namespace
+# of prefix, e.g. /codeBook/stdyDscr is ddi:codeBook/ddi:stdyDscr. Hooks
+# and profile are None if the format has no special cases or profile,
+# sections are the ones --stream copies through without parsing.
+Format = namedtuple("Format", "name export root prefix nsmap defaults hooks profile sections")
+
+OAI_DDI = Format(
+    "oai_ddi", "export_oai_ddi.cached", "/codeBook", "ddi", NSMAP, DEFAULTS, HOOKS, PROFILE, SECTIONS
+)
+# The same codeBook as the OAI export, so it shares its rules
+DDI = OAI_DDI._replace(name="ddi", export="export_ddi.cached")
+OAI_DC = Format(
+    "oai_dc",
+    "export_oai_dc.cached",
+    "/dc",
+    "oai_dc",
+    OAI_DC_NSMAP,
+    root / "assets/defaults_oai_dc.json",
+    None,
+    None,
+    (),
+)
+DCTERMS = Format(
+    "dcterms",
+    "export_dcterms.cached",
+    "/metadata",
+    "dcmi",
+    DCTERMS_NSMAP,
+    root / "assets/defaults_dcterms.json",
+    None,
+    None,
+    (),
+)
+FORMATS = {f.name: f for f in (OAI_DDI, DDI, OAI_DC, DCTERMS)}
+
+# Outcomes of processing a single file
+SKIPPED = "skipped"
+CHANGED = "changed"
+UNCHANGED = "unchanged"
+SYNTAX_ERROR = "syntax error"
+XPATH_ERROR = "xpath error"
+WRITE_ERROR = "write error"
+OVER_BUDGET = "over budget"
+QUARANTINED = "quarantined"
+
+# Outcomes that put a file into quarantine until its content changes
+QUARANTINE = (SYNTAX_ERROR, XPATH_ERROR, OVER_BUDGET)
+
+METRICS = Metrics()  # counters and timings of the current run
+
+# Result of processing a single file. State is the file's new manifest
+# entry, fired the rules that changed it and diff is only set in dry runs.
+# Violations are the profile rules the file does not meet after the run,
+# None if it could not be checked or its format has no profile.
+Result = namedtuple("Result", "filename outcome state fired diff violations seconds")
+
+# What format_metadata returns for a file, see Result. Digest is the
+# sha256 hex digest of the export after the call, None if unknown, e.g.
+# because it was streamed or could not be processed.
+Transformed = namedtuple("Transformed", "outcome fired diff violations digest")
+
+CHUNK_SIZE = 16  # files processed, synced and replaced together
+
+# Overlapped I/O: threads reading exports, files read ahead and batches
+# waiting to be written. Without threads every file is read, transformed
+# and written in turn.
+IO = namedtuple("IO", "threads read_ahead write_behind")
+NO_IO = IO(0, 0, 0)
+
+# How files are processed, passed down from run to format_metadata and
+# sent to the worker processes once. A dry run writes nothing, streaming
+# copies sections no rule points into through unparsed. The transform
+# cache, archive and budget are None if not used. With timings, every
+# rule and hook is timed in the metrics.
+Options = namedtuple(
+    "Options",
+    "dry_run stream cache archive io budget timings",
+    defaults=(False, False, None, None, NO_IO, None, False),
+)
+DEFAULT_OPTIONS = Options()
+
+EXPORT = OAI_DDI.export
+EXPORTS = {f.export: f for f in FORMATS.values()}  # file name -> format
+FILES_DIR = "files"  # Dataverse's files.directory, holds one folder per dataset
+SKIP_DIRS = {"temp", "tmp", "lost+found"}  # never contain exports
+MAX_DEPTH = 4  # folders below files/: authority, shoulders and identifier
+
 # ------------------------------------------------------------------------- #
 # Util functions
 # ------------------------------------------------------------------------- #
 
 
-def read_json_file(filename):
-    try:
-        with open(filename, encoding="utf-8") as f:
-            return json.load(f)
-    except:
-        logging.error("File with default values not found.")
-        sys.exit(1)
+def format_of(filename):
+    """The Format of an export, by its name. Other files are DDI."""
+    return EXPORTS.get(Path(filename).name, OAI_DDI)
+
+
+def stream_tags(rules, fmt):
+    """The sections of an export of fmt that are not parsed, see --stream"""
+    return streamable([r.rule for r in rules], fmt.sections)
 
 
 def pretty_xml(xml, indent=False):
     return etree.tostring(xml, method="xml", pretty_print=indent, encoding=str)
 
 
+def sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def serialize(xml, indent=False):
+    return etree.tostring(xml, method="xml", pretty_print=indent, encoding="utf-8")
+
+
 def save_xml(xml, filename, indent=True):
-    with open(filename, "w") as f:
-        f.write(pretty_xml(xml, indent))
+    with AtomicWriter() as w:
+        w.write(filename, serialize(xml, indent))
 
 
 # ------------------------------------------------------------------------- #
@@ -67,222 +203,1368 @@ def save_xml(xml, filename, indent=True):
 # ------------------------------------------------------------------------- #
 
 
-def gen_metadata_xpath(path):
+def gen_metadata_xpath(path, prefix="ddi"):
     """Returns a properly formated xpath that lxml can read.
     Used as intermediate step to get an element in an xml
-    from a specified rule in the defaults.json
+    from a specified rule in the defaults.json. Steps without
+    a namespace get the prefix of the format.
     """
 
-    # Only add namespce after /codebook/
-    _, item = path.split("/codeBook")
-
     # Seperate attribute from path
-    if "@" in item:
-        p, attrib = item.split("/@")
-    else:
-        p = item
+    element, sep, attrib = path.strip().partition("/@")
 
-    # Modify only if path is not just /codeBook/
-    if len(p) > 1:
-        p = [f"ddi:{i}" for i in p.split("/")[1:]]
-        p = "/".join([i for i in p])
+    # Add the namespace to every step that has none
+    steps = [s if ":" in s else f"{prefix}:{s}" for s in element.strip("/").split("/")]
+    return "//" + "/".join(steps) + sep + attrib
 
-    # Merge together
-    if "@" in item:
-        if len(p) > 1:
-            full = "//ddi:codeBook/" + p + "/@" + attrib
-        else:
-            # Edge case at root of /codeBook/
-            full = "//ddi:codeBook/" + "@" + attrib
-    else:
-        full = "//ddi:codeBook/" + p
 
-    # Return without whitespaces
-    return full.strip()
+# Elements the special cases look up
+DEPOSITOR = etree.XPath(gen_metadata_xpath("/codeBook/stdyDscr/citation/distStmt/depositr"), namespaces=NSMAP)
+VERSION_DATE = etree.XPath(gen_metadata_xpath("/codeBook/docDscr/citation/verStmt/version/@date"), namespaces=NSMAP)
+DOC_IDNO = etree.XPath(gen_metadata_xpath("/codeBook/docDscr/citation/titlStmt/IDNo"), namespaces=NSMAP)
+DOC_DIST_DATE = etree.XPath(gen_metadata_xpath("/codeBook/docDscr/citation/distStmt/distDate"), namespaces=NSMAP)
+
+
+# Setup response as XML. Created once and reused for every file.
+# Hardened against pathological exports: entities are not expanded,
+# nothing is fetched from the network and libxml2's limits on depth and
+# text size stay in place.
+XML_PARSER = etree.XMLParser(
+    remove_blank_text=True,
+    remove_comments=True,
+    load_dtd=True,
+    attribute_defaults=True,
+    ns_clean=True,
+    encoding="utf-8",
+    resolve_entities=False,
+    no_network=True,
+    huge_tree=False,
+)
+
+
+class Rule:
+    """A rule from the defaults.json compiled into lxml XPath objects.
+    Built once per run so that no xpath strings are split or compiled
+    while files are processed.
+    """
 
+    def __init__(self, rule, value, hooks=(), fmt=OAI_DDI):
+        self.rule = rule
+        self.value = value
+        self.path = gen_metadata_xpath(rule, fmt.prefix)
+        self.hooks = hooks  # (name, function) of its special cases
+        self.attrib = None
+        self.ns = None
+        self.qname = None
 
-def add_element_xpath(metadata, path):
-    """Creates a properly formated xpath that lxml can use.
-    Used to create new elements in the XML file at the
+        element = self.path
+        if "@" in self.path:
+            # Separate attribute e.g. @abbr or @xml:lang from path
+            element, self.attrib = self.path.split("@")
+            # Ensure that last element is not a slash so that we can find element
+            element = element[:-1] if element[-1] == "/" else element
+            if ":" in self.attrib:
+                # Attribute rule with namespace
+                self.ns, self.attrib = self.attrib.split(":")
+                self.qname = "{" + fmt.nsmap[self.ns] + "}" + self.attrib
+            else:
+                self.qname = self.attrib
+
+        self.find = etree.XPath(element, namespaces=fmt.nsmap)
+        # Superpath and tag, used if the element has to be created
+        elements = element.split("/")
+        self.find_parent = etree.XPath("/".join(elements[:-1]), namespaces=fmt.nsmap)
+        tag_prefix, self.tag = elements[-1].split(":")
+        # Namespace of a new element, by default the one of its parent
+        self.tag_ns = fmt.nsmap[tag_prefix] if tag_prefix != fmt.prefix else None
+
+    def is_attribute(self):
+        return self.attrib is not None
+
+
+def resolve_hooks(config, defaults, fmt=OAI_DDI):
+    """Resolves the hooks file to a dict of compiled rule path ->
+    [(name, function)]. Raises ConfigError if a hook is unknown, of
+    the wrong kind for its rule or declared for a rule that is not in
+    the defaults.
+    """
+    paths = {gen_metadata_xpath(rule, fmt.prefix) for rule in defaults}
+    hooks, errors = {}, []
+    for rule, names in config.items():
+        names = [names] if isinstance(names, str) else names
+        path = gen_metadata_xpath(rule, fmt.prefix)
+        if path not in paths:
+            errors.append(f"{rule}: hooks for a rule that is not in the defaults")
+            continue
+        attribute = "/@" in path
+        for name in names:
+            if name not in HOOK_REGISTRY:
+                errors.append(f"{rule}: unknown hook {name}")
+            elif HOOK_REGISTRY[name].attribute != attribute:
+                kind = "attribute" if HOOK_REGISTRY[name].attribute else "element"
+                errors.append(f"{rule}: {name} is an {kind} hook")
+            else:
+                hooks.setdefault(path, []).append((name, HOOK_REGISTRY[name].function))
+    if errors:
+        raise ConfigError("Invalid hooks: " + "; ".join(errors))
+    return hooks
+
+
+def compile_rules(defaults, hooks, fmt=OAI_DDI):
+    """Compiles all rules of the defaults of a format and attaches
+    their hooks. Raises ConfigError if a rule or hook is invalid.
+    """
+    hooks = resolve_hooks(hooks, defaults, fmt)
+    rules, invalid = [], []
+    for rule, value in defaults.items():
+        try:
+            path = gen_metadata_xpath(rule, fmt.prefix)
+            rules.append(Rule(rule, value, tuple(hooks.get(path, ())), fmt))
+        except (etree.XPathSyntaxError, KeyError, IndexError, ValueError):
+            invalid.append(rule)
+    if invalid:
+        raise ConfigError("Invalid rules: " + ", ".join(invalid))
+    return rules
+
+
+def load_config(fmt):
+    """Reads, validates and compiles the defaults and hooks files of a
+    format. Raises ConfigError if they are invalid.
+    """
+    return Config(
+        fmt.defaults, fmt.hooks, fmt.profile, partial(compile_rules, fmt=fmt), root=fmt.root
+    )
+
+
+def load_rules(filename=DEFAULTS, hooks=HOOKS, fmt=OAI_DDI):
+    """Reads, validates and compiles the defaults and hooks files"""
+    return load_config(fmt._replace(defaults=filename, hooks=hooks)).rules
+
+
+def add_element(xml, rule):
+    """Creates the element of a rule in the XML file at the
     correct position.
     """
 
     # Assume last piece of path is not found
-    elements = path.split("/")
-    existing_el, new_el = (
-        "/".join([p for p in elements[:-1]]),
-        elements[-1].split(":")[1],
-    )
-    root_el = metadata.xpath(existing_el, namespaces=NSMAP)
+    root_el = rule.find_parent(xml)
     if len(root_el) > 0:  # superpath exists
-        new = etree.SubElement(root_el[0], new_el)
-        return new
+        parent = root_el[0]
     else:  # superpath does not exist
-        new = etree.SubElement(metadata.getroot(), new_el)
-        return new
+        parent = xml.getroot()
+    # New elements inherit the default namespace of their parent, just as
+    # they would after the file is written and parsed again, unless the
+    # rule gives one, e.g. dc:language
+    ns = rule.tag_ns if rule.tag_ns is not None else parent.nsmap.get(None)
+    new = etree.SubElement(parent, etree.QName(ns, rule.tag))
+    METRICS.inc("elements_created_total")
+    return new
 
 def is_gfk(xml):
-    de = gen_metadata_xpath("/codeBook/stdyDscr/citation/distStmt/depositr")
-    da = gen_metadata_xpath("/codeBook/docDscr/citation/verStmt/version/@date")
-
-    depositor = xml.xpath(de, namespaces=NSMAP)
-    vdate = xml.xpath(da, namespaces=NSMAP)
+    depositor = DEPOSITOR(xml)
+    vdate = VERSION_DATE(xml)
     
     if len(depositor) > 0 and len(vdate) > 0:
-        if depositor[0].text == "GfK Austria" and date.fromisoformat(vdate[0]) < date.fromisoformat("2022-01-18"):
-            return True
-    else:
+        try:
+            if depositor[0].text == "GfK Austria" and date.fromisoformat(vdate[0]) < date.fromisoformat("2022-01-18"):
+                return True
+        except ValueError:
+            logging.warning("Invalid version date '%s'", vdate[0])
+    return False
+
+
+class Facts:
+    """Facts about a single document that the special cases need.
+    Each fact is looked up the first time it is needed and then
+    shared by all rules. Missing facts are None.
+    """
+
+    def __init__(self, xml):
+        self.xml = xml
+
+    @cached_property
+    def gfk(self):
+        return is_gfk(self.xml)
+
+    @cached_property
+    def doi_url(self):
+        idno = DOC_IDNO(self.xml)
+        if len(idno) == 0 or idno[0].text is None or ":" not in idno[0].text:
+            return None
+        _, u = idno[0].text.split(":", 1)
+        return "https://doi.org/" + u
+
+    @cached_property
+    def dist_date(self):
+        dist_date = DOC_DIST_DATE(self.xml)
+        return dist_date[0].text if len(dist_date) > 0 else None
+
+
+# Special cases, declared per rule path in assets/hooks.json. Attribute
+# hooks get (element, facts, value, force) and return the value and
+# force to use, element hooks get (element, facts) and return True if
+# they removed the element. Each may only be used for its kind of rule.
+Hook = namedtuple("Hook", "function attribute")
+HOOK_REGISTRY = {}
+
+
+def hook(name, attribute=False):
+    def register(f):
+        HOOK_REGISTRY[name] = Hook(f, attribute)
+        return f
+
+    return register
+
+
+@hook("gfk_lang", attribute=True)
+def gfk_lang(el, facts, value, force):
+    if facts.gfk:
+        logging.debug("Attribute value for GfK file")
+        return "de", True
+    return value, force
+
+
+@hook("force", attribute=True)
+def force_value(el, facts, value, force):
+    logging.debug("Override attribute with default value")
+    return value, True
+
+
+@hook("holdings_uri", attribute=True)
+def holdings_uri(el, facts, value, force):
+    if facts.doi_url is None:
+        logging.warning("No DOI in docDscr IDNo, using default holdings URL")
+        return value, force
+    logging.debug("Generated holdings URL '%s'", facts.doi_url)
+    return facts.doi_url, force
+
+
+@hook("dist_date", attribute=True)
+def dist_date(el, facts, value, force):
+    if facts.dist_date is None:
+        logging.warning("No distDate in docDscr, using default date")
+        return value, force
+    logging.debug("Copied date '%s' from distDate", facts.dist_date)
+    return facts.dist_date, force
+
+
+@hook("nation_abbr", attribute=True)
+def nation_abbr(el, facts, value, force):
+    iso_code = country_code(el.text)
+    if iso_code is None:
+        METRICS.inc("nations_unresolved_total", nation=el.text or "")
+    value = iso_code if iso_code is not None else "ZZ"  # ZZ == unkown or unspecified country
+    logging.debug("Got nation abbrevation of nation '%s' -> '%s'", el.text, value)
+    return value, True
+
+
+@hook("drop_social_sciences")
+def drop_social_sciences(el, facts):
+    if el.text != "Social Sciences":
         return False
-           
+    logging.debug("Removed element at %s", el)
+    el.getparent().remove(el)
+    METRICS.inc("elements_removed_total")
+    return True
+
+
+def call_hook(name, hook, *args):
+    """Calls a hook, timed if the metrics are detailed"""
+    if not METRICS.detailed:
+        return hook(*args)
+    with METRICS.timer("hook_seconds", hook=name):
+        return hook(*args)
+
+
 def set_text(el, value, p):
+    """Sets the text of an empty element, returns if it changed"""
     if el.text == None:
-        el.text = value
+        # Empty defaults leave the element empty (<el/>), not <el></el>
+        el.text = value if value else None
+        METRICS.inc("texts_set_total")
         logging.debug('Element "%s" added text "%s"', p, value)
+        return bool(value)
     else:
         logging.debug('Element "%s" already set to "%s"', p, el.text)
+        return False
 
-def set_attribute(el, attrib, ns, p, xml, value, force=False):
-    # Special conditions
-    if p == gen_metadata_xpath("/codeBook/@xml:lang") and is_gfk(xml):
-        value = "de"
-        force = True
-        logging.debug("Attribute value for GfK file")
-    if p == gen_metadata_xpath("/codeBook/stdyDscr/stdyInfo/subject/keyword/@vocabURI"):
-        force = True
-        logging.debug("Override vocabURI")
-    if p == gen_metadata_xpath("/codeBook/stdyDscr/citation/holdings/@URI"):
-        val = xml.xpath(gen_metadata_xpath("/codeBook/docDscr/citation/titlStmt/IDNo"), namespaces=NSMAP)[0]
-        _, u = val.text.split(":")
-        url = "https://doi.org/" + u
-        value = url
-        logging.debug(f"Generated holdings URL '{value}'")
-    if p == gen_metadata_xpath("/codeBook/stdyDscr/citation/distStmt/distDate/@date"):
-        val = xml.xpath(gen_metadata_xpath("/codeBook/docDscr/citation/distStmt/distDate"), namespaces=NSMAP)[0]
-        value = val.text
-        logging.debug(f"Copied date '{value}' from distDate")
-    if p == gen_metadata_xpath("/codeBook/stdyDscr/stdyInfo/sumDscr/nation/@abbr"):
-        force = True
-        iso_code = cc.get(el.text)
-        value = iso_code if iso_code is not None else "ZZ"  # ZZ == unkown or unspecified country
-        logging.debug(f"Got nation abbrevation of nation '{el.text}' -> '{value}'")
-
-
-    # See if element contains attribute
-    attrib_exists = any([attrib in a for a in el.attrib.keys()])
-    if not attrib_exists:
-        # Add namespace to attrib if needed
-        if ns is not None:
-            attrib = "{" + NSMAP[ns] + "}" + attrib
+def set_attribute(el, rule, facts, value, force=False):
+    """Sets the attribute of a rule if missing, empty or forced,
+    returns if it changed.
+    """
+    p = rule.path
+    for name, hook in rule.hooks:
+        value, force = call_hook(name, hook, el, facts, value, force)
+
+    val = el.get(rule.qname)
+    if val is None:
         # Set attribute with default value
         logging.debug('Attribute "%s" set to "%s"', p, value)
-        el.set(attrib, value)
+        el.set(rule.qname, value)
+        METRICS.inc("attributes_set_total")
+        return True
+    elif force:
+        el.set(rule.qname, value)
+        METRICS.inc("attributes_forced_total")
+        logging.debug('Forced overwrite attribute on "%s" from "%s" set to "%s"', p, val, value)
+        return val != value
+    elif len(val) > 0:
+        logging.debug('Attribute "%s" already present, set to "%s"', p, val)
+        return False
     else:
-        v = [a for a in el.attrib if attrib in a][0]
-        if force:
-            val = el.attrib[v]
-            el.attrib[v] = value
-            logging.debug('Forced overwrite attribute on "%s" from "%s" set to "%s"', p, val, value)
-        else:
-            val = el.attrib[v]
-            if len(val) > 0:
-                logging.debug('Attribute "%s" already present, set to "%s"', p, val)
-            else:
-                el.attrib[v] = value
-                logging.debug('Attribute "%s" set to "%s"', p, value)
-
+        el.set(rule.qname, value)
+        METRICS.inc("attributes_set_total")
+        logging.debug('Attribute "%s" set to "%s"', p, value)
+        return bool(value)
 
-def attribute_rule(p, value, xml):
-    # Separate attribute e.g. @abbr or @xml:lang from path
-    ns = None
-    path, attrib = p.split("@")
-    # Ensure that last element is not a slash so that we can find element
-    path = path[:-1] if path[-1] == "/" else path
-    if ":" in attrib:
-        # Attribute rule with namespace
-        ns, attrib = attrib.split(":")
 
+def attribute_rule(rule, xml, facts):
     # Use first occurance if element exists, add if it does not
-    el = xml.xpath(path, namespaces=NSMAP)
+    el = rule.find(xml)
     if len(el) == 0:
-        logging.debug('Element "%s" added' , p)
-        el = add_element_xpath(xml, path)
-        set_attribute(el, attrib, ns, p, xml, value)
+        logging.debug('Element "%s" added' , rule.path)
+        el = add_element(xml, rule)
+        set_attribute(el, rule, facts, rule.value)
+        return True
     else:
+        changed = False
         for e in el:
-            set_attribute(e, attrib, ns, p, xml, value)
+            changed |= set_attribute(e, rule, facts, rule.value)
+        return changed
 
 
-def element_rule(p, value, xml):
+def element_rule(rule, xml, facts):
     # Element rule, e.g. nation
-    el = xml.xpath(p, namespaces=NSMAP)
+    p = rule.path
+    el = rule.find(xml)
     if len(el) == 0:  # element does not exist
-        el = add_element_xpath(xml, p)
+        el = add_element(xml, rule)
         logging.debug('Element "%s" added', p)
-        set_text(el, value, p)
+        set_text(el, rule.value, p)
+        return True
     else:
+        changed = False
         for e in el:
-            s = gen_metadata_xpath("/codeBook/stdyDscr/stdyInfo/subject/keyword")
-            if e.text == "Social Sciences" and p == s:
-                logging.debug(f"Removed element at {e}")
-                e.getparent().remove(e) 
-
-            set_text(e, value, p)
-
-
-def format_metadata(filename):
-    # Setup response as XML
-    xml_parser = etree.XMLParser(
-        remove_blank_text=True,
-        remove_comments=True,
-        load_dtd=True,
-        attribute_defaults=True,
-        ns_clean=True,
-        encoding="utf-8",
-    )
-
-    try: 
-        defaults = read_json_file(str(DEFAULTS))
-        # Iterate over paths and set default values if no value present
-        for rule, value in defaults.items():
-            # Get current file
-            xml = etree.parse(filename, parser=xml_parser)   
-
-            # Verfiy element or attribute
-            p = gen_metadata_xpath(rule)
-            if "@" in p:
-                attribute_rule(p, value, xml)
-            else:
-                element_rule(p, value, xml)
+            removed = False
+            for name, hook in rule.hooks:
+                removed = call_hook(name, hook, e, facts)
+                if removed:
+                    break
+            if removed:
+                changed = True
+                continue
+
+            changed |= set_text(e, rule.value, p)
+        return changed
+
+
+def apply_rule(rule, xml, facts):
+    # Verfiy element or attribute
+    if rule.is_attribute():
+        return attribute_rule(rule, xml, facts)
+    return element_rule(rule, xml, facts)
+
+
+def apply_rules(xml, rules, budget=None):
+    """Applies all rules to a parsed export in place.
+    Returns the rules that changed the export.
+    """
+    fired = []
+    facts = Facts(xml)
+    detailed = METRICS.detailed
+    for rule in rules:
+        if budget is not None:
+            budget.check(rule.rule, memory=False)
+        if detailed:
+            with METRICS.timer("rule_seconds", rule=rule.rule):
+                changed = apply_rule(rule, xml, facts)
+        else:
+            changed = apply_rule(rule, xml, facts)
+        if changed:
+            fired.append(rule.rule)
+            METRICS.inc("rules_fired_total", rule=rule.rule)
+    METRICS.inc("rules_applied_total", len(rules))
+    return fired
 
-            # Save to file on every change. Terribly inefficient. 
-            # TODO change to memory caching.
-            new = pretty_xml(xml, indent=True)
-            with open(filename, "w") as f:
-                f.write(new)
+
+def count_violations(violations):
+    for v in violations:
+        METRICS.inc("profile_violations_total", rule=v.xpath, level=v.level)
+
+
+def read_export(filename, tags=(), budget=None):
+    """Returns the bytes of an export and the byte ranges of the
+    sections that were left out, see stream.split. Exports larger than
+    the budget allows are not read, BudgetExceeded is raised instead.
+    """
+    if budget is not None:
+        budget.check_size(os.stat(filename).st_size)
+    if tags:
+        return split(filename, tags)
+    with open(filename, "rb") as f:
+        return f.read(), []
+
+
+def write_export(filename, data, writer=None, archive=None, original=None):
+    with METRICS.timer("phase_seconds", phase="write"):
+        if archive is not None:
+            archive.add(filename, original)
+        if writer is not None:
+            writer.write(filename, data)
+        else:
+            with AtomicWriter() as w:
+                w.write(filename, data)
+
+
+def format_metadata(filename, rules=None, options=DEFAULT_OPTIONS, writer=None, data=None):
+    """Applies the rules of the export's format to it and writes it back
+    if any rule changed it, returns a Transformed. Data is what
+    read_export returned if the export was read ahead. With a writer,
+    the file is only replaced once the writer is flushed.
+    """
+    diff = None
+    fmt = format_of(filename)
+    dry_run, stream, budget = options.dry_run, options.stream, options.budget
+    cache, archive = options.cache, options.archive
+    try:
+        if rules is None:
+            rules = load_rules(fmt.defaults, fmt.hooks, fmt)
+        # Parse once and apply every rule to the same in-memory tree
+        ranges = []
+        if budget is not None:
+            budget.start()
+        with METRICS.timer("phase_seconds", phase="read"):
+            tags = stream_tags(rules, fmt) if stream else []
+            raw, ranges = data if data is not None else read_export(filename, tags, budget)
+        # Streamed exports are not read as a whole, so they cannot be looked up
+        digest = sha256(raw) if not ranges else None
+        key = cache.key(digest, fmt.name) if cache is not None and not dry_run and not tags else None
+        if key is not None:
+            hit = cache.get(key)
+            METRICS.inc("transform_cache_total", result="miss" if hit is None else "hit")
+            if hit is not None:
+                output, meta = hit
+                violations = meta["violations"]
+                if violations is not None:
+                    violations = [compliance.Violation(*v) for v in violations]
+                    count_violations(violations)
+                if output is None:
+                    return Transformed(UNCHANGED, meta["fired"], diff, violations, digest)
+                write_export(filename, output, writer, archive, raw)
+                return Transformed(CHANGED, meta["fired"], diff, violations, sha256(output))
+
+        with METRICS.timer("phase_seconds", phase="parse"):
+            xml = etree.fromstring(raw, parser=XML_PARSER, base_url=filename).getroottree()
+        # Kept for the archive, streamed exports are not read as a whole
+        original = raw if not ranges else None
+        del raw
+        if ranges and not placeholders_ok(xml, ranges):
+            logging.warning("Cannot stream %s, processing it as a whole", filename)
+            return format_metadata(filename, rules, options._replace(stream=False), writer)
+        if budget is not None:
+            budget.check("parsing")
+        if dry_run:
+            old = pretty_xml(xml, indent=True)
+        with METRICS.timer("phase_seconds", phase="rules"):
+            fired = apply_rules(xml, rules, budget)
+        if budget is not None:
+            budget.check("applying the rules")
+        # Checked on the same tree, sections that were not parsed are skipped
+        violations = None
+        if fmt.profile is not None:
+            with METRICS.timer("phase_seconds", phase="validate"):
+                violations = compliance.load(fmt.profile).validate(xml, skip=tags)
+            count_violations(violations)
+
+        # Already compliant, leave the file and its mtime alone
+        if not fired:
+            if key is not None:
+                cache.put(key, None, {"fired": fired, "violations": violations})
+            return Transformed(UNCHANGED, fired, diff, violations, digest)
+
+        # Save to file once all rules are applied
+        with METRICS.timer("phase_seconds", phase="serialize"):
+            new = serialize(xml, indent=True)
+        if budget is not None:
+            budget.check("serializing")
+        if key is not None:
+            cache.put(key, new, {"fired": fired, "violations": violations})
+        digest = None
+        if dry_run:
+            lines = difflib.unified_diff(
+                old.splitlines(), new.decode("utf-8").splitlines(), filename, filename, n=0, lineterm=""
+            )
+            diff = "\n".join(lines)
+        elif ranges:
+            write_export(filename, join(new, filename, ranges), writer, archive, original)
+        else:
+            write_export(filename, new, writer, archive, original)
+            digest = sha256(new)
+        return Transformed(CHANGED, fired, diff, violations, digest)
 
     except etree.XMLSyntaxError:
         logging.error("XMLSyntaxError at %s", filename)
+        return Transformed(SYNTAX_ERROR, [], diff, None, None)
     except etree.XPathEvalError:
         logging.error("XPathEvalError at %s", filename)
-    except etree.XPathSyntaxError:
-        logging.error("XPathSyntaxError at %s", filename)
+        return Transformed(XPATH_ERROR, [], diff, None, None)
+    except BudgetExceeded as e:
+        logging.error("Over budget at %s: %s", filename, e)
+        return Transformed(OVER_BUDGET, [], diff, None, None)
+    except MemoryError:
+        logging.error("Out of memory at %s", filename)
+        return Transformed(OVER_BUDGET, [], diff, None, None)
+    except FileNotFoundError:
+        # Removed since it was found, e.g. a dataset was deleted
+        logging.info("Skipping %s, it no longer exists", filename)
+        return Transformed(SKIPPED, [], diff, None, None)
+    except OSError as e:
+        logging.error("Cannot write %s: %s", filename, e)
+        return Transformed(WRITE_ERROR, [], diff, None, None)
 
-    return None
+
+def transform_batch(items, rulesets, options, writer):
+    """Transforms (filename, data) items, data being the export if it
+    was read ahead, with the rules of their format. Returns the filename,
+    the Transformed and the seconds it took of every file.
+    """
+    done = []
+    for filename, data in items:
+        logging.info("Processng file %s", filename)
+        started = time.perf_counter()
+        rules = rulesets[format_of(filename).name]
+        transformed = format_metadata(str(filename), rules, options, writer, data)
+        done.append((filename, transformed, time.perf_counter() - started))
+    return done
+
+
+def flush_batch(writer, done, dry_run):
+    """Replaces the changed files of a batch. Returns the files that
+    failed, the new state of the others and the seconds it took. The
+    content of a file is only read again if its hash is not known.
+    """
+    started = time.perf_counter()
+    failed = writer.flush()
+    states = {}
+    for filename, transformed, _ in done:
+        if transformed.outcome in (CHANGED, UNCHANGED) and not dry_run and str(filename) not in failed:
+            try:
+                states[str(filename)] = file_state(filename, transformed.digest)
+            except FileNotFoundError:
+                pass  # removed meanwhile, processed again if it comes back
+    return failed, states, time.perf_counter() - started
+
+
+def batch_results(done, failed, states, archive=None):
+    """Returns the Results of a flushed batch, the originals of the
+    files that were replaced are recorded in the archive.
+    """
+    results = []
+    for filename, transformed, seconds in done:
+        outcome, violations = transformed.outcome, transformed.violations
+        if str(filename) in failed:
+            outcome, violations = WRITE_ERROR, None
+        state = states.get(str(filename))
+        if archive is not None:
+            if outcome == CHANGED and state is not None:
+                archive.record(filename, state[2])
+            else:
+                archive.discard(filename)
+        results.append(
+            Result(filename, outcome, state, transformed.fired, transformed.diff, violations, seconds)
+        )
+    return results
+
+
+def process_batch(filenames, rulesets, options=DEFAULT_OPTIONS):
+    """Processes a batch of exports with the rules of their format,
+    rulesets maps format names to rules. Returns their Results. Changed
+    files are synced and replaced together at the end of the batch,
+    only then are their originals recorded in the archive.
+    """
+    writer = AtomicWriter()
+    try:
+        items = ((filename, None) for filename in filenames)
+        done = transform_batch(items, rulesets, options, writer)
+    except BaseException:
+        writer.discard()
+        raise
+    failed, states, seconds = flush_batch(writer, done, options.dry_run)
+    METRICS.observe("phase_seconds", seconds, phase="flush")
+    return batch_results(done, failed, states, options.archive)
+
+
+def prefetched(future):
+    """The export read ahead, None if reading failed or the export is
+    over budget. It is read again then, so that the error is handled
+    like any other.
+    """
+    try:
+        return future.result()
+    except (OSError, BudgetExceeded):
+        return None
+
+
+def process_pipelined(files, rulesets, options):
+    """Yields the Result of every file like process_batch, with the
+    I/O overlapped: io.threads threads read up to io.read_ahead files
+    ahead, and a writer thread writes and replaces up to io.write_behind
+    batches while the next ones are transformed. Parsing, the rules,
+    the cache and the archive stay in the calling thread. The
+    utilisation of the stages is added to the metrics.
+    """
+    io = options.io
+    tags = {
+        name: stream_tags(rules, FORMATS[name]) if options.stream else []
+        for name, rules in rulesets.items()
+    }
+    read = Stage("read", io.threads)
+    transform = Stage("transform")
+    write = Stage("write")
+    started = time.perf_counter()
+
+    def finish(future, done):
+        failed, states, seconds = future.result()
+        write.add(seconds)
+        METRICS.observe("phase_seconds", seconds, phase="flush")
+        return batch_results(done, failed, states, options.archive)
+
+    with ThreadPoolExecutor(io.threads, thread_name_prefix="read") as readers, ThreadPoolExecutor(
+        1, thread_name_prefix="write"
+    ) as writers:
+        fetched = prefetch(
+            files,
+            lambda f: read_export(f, tags[format_of(f).name], options.budget),
+            readers,
+            max(io.read_ahead, 1),
+            read,
+        )
+        flushing = deque()
+        for chunk in chunks(fetched, CHUNK_SIZE):
+            writer = DeferredWriter()
+            items = ((filename, prefetched(future)) for filename, future in chunk)
+            done = transform_batch(items, rulesets, options, writer)
+            transform.add(sum(seconds for _, _, seconds in done))
+            flushing.append((writers.submit(flush_batch, writer, done, options.dry_run), done))
+            if len(flushing) > io.write_behind:
+                yield from finish(*flushing.popleft())
+        while flushing:
+            yield from finish(*flushing.popleft())
+
+    seconds = time.perf_counter() - started
+    for stage in (read, transform, write):
+        METRICS.inc("stage_busy_seconds_total", stage.busy, stage=stage.name)
+        METRICS.inc("stage_available_seconds_total", seconds * stage.threads, stage=stage.name)
+        logging.debug("Stage %s busy %.0f%% of the time", stage.name, 100 * stage.utilisation(seconds))
+
+
+# Rules per format and Options of a worker process, set up once when
+# the worker starts
+worker_rulesets = None
+worker_options = DEFAULT_OPTIONS
+
+
+def init_worker(configs, options, log_queue, log_level):
+    global worker_rulesets, worker_options
+    logs.use_queue(log_queue, log_level)
+    # Compiled from what the parent validated, not read from disk again
+    worker_rulesets = {
+        name: compile_rules(*data, fmt=FORMATS[name]) for name, data in configs.items()
+    }
+    worker_options = options
+    METRICS.reset()
+    METRICS.detailed = options.timings
+
+
+def worker_process_files(filenames):
+    if worker_options.io.threads > 0:
+        results = list(process_pipelined(filenames, worker_rulesets, worker_options))
+    else:
+        results = process_batch(filenames, worker_rulesets, worker_options)
+    return results, METRICS.snapshot()
+
+
+def collect(future):
+    results, metrics = future.result()
+    METRICS.merge(metrics)
+    return results
+
+
+def chunks(iterable, size):
+    it = iter(iterable)
+    while chunk := list(islice(it, size)):
+        yield chunk
+
+
+def process_files(files, configs, workers=1, options=DEFAULT_OPTIONS):
+    """Yields the Result of every file, processed with the Config of its
+    format in configs (by name) in batches and spread
+    across a pool of worker processes if more than one is requested.
+    Files are consumed lazily, at most two chunks per worker are queued.
+    With I/O threads, every process overlaps reading and writing with
+    the transformation, see process_pipelined.
+    """
+    METRICS.detailed = options.timings
+    if workers > 1:
+        level = logging.getLogger().level
+        data = {name: c.data for name, c in configs.items()}
+        with logs.worker_queue() as q, ProcessPoolExecutor(
+            workers, initializer=init_worker, initargs=(data, options, q, level)
+        ) as pool:
+            pending = deque()
+            for chunk in chunks(files, CHUNK_SIZE):
+                pending.append(pool.submit(worker_process_files, chunk))
+                if len(pending) >= 2 * workers:
+                    yield from collect(pending.popleft())
+            while pending:
+                yield from collect(pending.popleft())
+        return
+
+    rulesets = {name: c.rules for name, c in configs.items()}
+    if options.io.threads > 0:
+        yield from process_pipelined(files, rulesets, options)
+    else:
+        for chunk in chunks(files, CHUNK_SIZE):
+            yield from process_batch(chunk, rulesets, options)
 
 
 # ------------------------------------------------------------------------- #
-# Main
+# File discovery
 # ------------------------------------------------------------------------- #
 
 
-def main():
-    logging.info("Starting run")
-    files = list(METADATA_ROOT.glob("**/files/**/export_oai_ddi.cached"))
+def is_ancestor(link, folder):
+    """True if a link points to folder or a folder above it"""
+    target = os.path.realpath(link) + os.sep
+    return (os.path.realpath(folder) + os.sep).startswith(target)
+
+
+def walk(top, in_files=False, depth=0, names=EXPORTS, visited=None):
+    """Yields (folder, depth, exports) for every folder below a files/
+    folder, as soon as the folder is read. Only directories are
+    descended into, hidden and temporary folders are skipped, and below
+    files/ the walk stops at the depth of Dataverse's dataset folders.
+    Exports are the files with one of the names, of all formats by
+    default, so every dataset folder is read once for all of them.
+    Symlinks are followed from files/ on, e.g. to a mounted share. Only
+    their targets are stat'ed, each is followed once and links back up
+    the tree are not followed.
+    """
+    try:
+        if visited is None:
+            st = os.stat(top)
+            visited = {(st.st_dev, st.st_ino)}
+        it = os.scandir(top)
+    except OSError as e:
+        logging.warning("Cannot read directory %s: %s", top, e)
+        return
+
+    dirs, exports = [], []
+    with it:
+        for entry in it:
+            if entry.name.startswith(".") or entry.name in SKIP_DIRS:
+                continue
+            try:
+                is_dir = entry.is_dir(follow_symlinks=in_files or entry.name == FILES_DIR)
+                if is_dir and entry.is_symlink():
+                    st = entry.stat()
+                    if (st.st_dev, st.st_ino) in visited or is_ancestor(entry.path, top):
+                        logging.debug("Skipping %s, read before", entry.path)
+                        continue
+                    visited.add((st.st_dev, st.st_ino))
+            except OSError:
+                is_dir = False  # e.g. a dangling link
+            if is_dir:
+                dirs.append(entry)
+            elif in_files and entry.name in names:
+                exports.append(Path(entry.path))
+
+    if in_files:
+        yield top, depth, exports
+    for entry in dirs:
+        if in_files:
+            if depth < MAX_DEPTH:
+                yield from walk(entry.path, True, depth + 1, names, visited)
+        else:
+            yield from walk(entry.path, entry.name == FILES_DIR, names=names, visited=visited)
+
+
+def find_exports(top, names=EXPORTS):
+    """Yields the exports below top as they are found"""
+    for _, _, exports in walk(top, names=names):
+        yield from exports
+
+
+def shard_of(filename, shards):
+    """Returns the shard (1 to shards) of an export. Decided by a hash
+    of its dataset folder below METADATA_ROOT, so that it is the same
+    on every host, whatever the mount point.
+    """
+    folder = Path(filename).parent
+    try:
+        folder = folder.relative_to(METADATA_ROOT)
+    except ValueError:
+        pass
+    digest = hashlib.sha256(folder.as_posix().encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % shards + 1
+
+
+def sharded(files, shard):
+    """Yields the files of a shard (i, n), all files without one"""
+    if shard is None:
+        yield from files
+        return
+    i, n = shard
     for filename in files:
-        logging.info("Processng file %s", filename)
-        format_metadata(str(filename))
-    logging.info("Done. Processed %s files.", len(files))
+        if shard_of(filename, n) == i:
+            yield filename
+
+
+# ------------------------------------------------------------------------- #
+# Main
+# ------------------------------------------------------------------------- #
+
+
+def report(result):
+    """Prints which rules would change a file in a dry run"""
+    print(f"{result.filename}: {len(result.fired)} rules would fire")
+    for rule in result.fired:
+        print(f"  {rule}")
+    if result.diff:
+        print(result.diff)
+
+
+def run(
+    files,
+    configs,
+    manifest,
+    workers=1,
+    full=False,
+    options=DEFAULT_OPTIONS,
+    checked=None,
+    quarantine=None,
+):
+    """Processes all files changed since the last run with the Config
+    of their format and returns the number of files per outcome.
+    A dry run writes neither the files, the manifest nor the quarantine.
+    The profile compliance of every processed file is added to the
+    checked Report, the originals of changed files are kept in the
+    archive under a new run. Files that fail or go over budget are
+    quarantined and skipped until their content changes.
+    """
+    dry_run, cache, archive = options.dry_run, options.cache, options.archive
+    checked = checked if checked is not None else compliance.Report()
+    if cache is not None:
+        cache.version = transform_version(configs)
+    if archive is not None:
+        archive.run = new_run_id()
+    summary = Counter()
+    unresolved = unresolved_nations()
+
+    def todo():
+        for filename in files:
+            if quarantine is not None and quarantine.holds(filename):
+                logging.debug("Skipping quarantined file %s", filename)
+                summary[QUARANTINED] += 1
+                METRICS.inc("files_total", outcome=QUARANTINED)
+            elif full or not manifest.is_current(filename):
+                yield filename
+            else:
+                logging.debug("Skipping unchanged file %s", filename)
+                summary[SKIPPED] += 1
+                METRICS.inc("files_total", outcome=SKIPPED)
+
+    busy = stage_seconds("stage_busy_seconds_total")
+    available = stage_seconds("stage_available_seconds_total")
+    for result in process_files(todo(), configs, workers, options):
+        logs.file_summary(
+            result.filename, result.outcome, result.fired, result.seconds, result.violations
+        )
+        if result.violations is not None:
+            checked.add(result.filename, result.violations)
+        summary[result.outcome] += 1
+        METRICS.inc("files_total", outcome=result.outcome)
+        if dry_run and result.fired:
+            report(result)
+        if result.state is not None:
+            manifest.update(result.filename, result.state)
+        if quarantine is not None and not dry_run:
+            if result.outcome in QUARANTINE:
+                quarantine.add(result.filename, result.outcome)
+                METRICS.inc("files_quarantined_total", reason=result.outcome)
+            elif result.state is not None and quarantine.release(result.filename):
+                logging.info("Released %s from quarantine", result.filename)
+    if not dry_run:
+        manifest.save()
+        if quarantine is not None:
+            quarantine.save()
+    if summary[QUARANTINED]:
+        logging.warning(
+            "Skipped %s quarantined files, they are retried once their content changes",
+            summary[QUARANTINED],
+        )
+    if archive is not None and summary[CHANGED] and not dry_run:
+        logging.info("Kept the originals of %s files as run %s", summary[CHANGED], archive.run)
+
+    unresolved = unresolved_nations() - unresolved
+    if unresolved:
+        logging.warning(
+            "Unknown nations, set to ZZ: %s",
+            ", ".join(f"'{k}' ({v})" for k, v in unresolved.most_common()),
+        )
+    busy = stage_seconds("stage_busy_seconds_total") - busy
+    available = stage_seconds("stage_available_seconds_total") - available
+    if busy:
+        logging.info(
+            "Stages busy: %s",
+            ", ".join(f"{k} {100 * busy[k] / v:.0f}%" for k, v in available.items()),
+        )
+    if checked.checked:
+        logging.info(
+            "%s of %s files meet all mandatory rules of the profile",
+            checked.compliant,
+            checked.checked,
+        )
+    return summary
+
+
+def rules_hash(configs):
+    """Hash of the rules of all formats, recorded in the state manifest"""
+    h = hashlib.sha256()
+    for name, config in sorted(configs.items()):
+        h.update(f"{name}:{config.hash}\n".encode("utf-8"))
+    return h.hexdigest()
+
+
+def transform_version(configs):
+    """Version of the transformation: the rules and the proxy's code"""
+    h = hashlib.sha256(rules_hash(configs).encode("utf-8"))
+    for source in sorted(Path(__file__).parent.glob("*.py")):
+        h.update(source.read_bytes())
+    return h.hexdigest()
+
+
+def stage_seconds(name):
+    """Seconds per pipeline stage, summed over all processes"""
+    return Counter({
+        dict(labels)["stage"]: v for (n, labels), v in METRICS.counters.items() if n == name
+    })
+
+
+def unresolved_nations():
+    """Names of nations without country code, counted by the workers"""
+    return Counter({
+        dict(labels)["nation"]: int(v)
+        for (name, labels), v in METRICS.counters.items()
+        if name == "nations_unresolved_total"
+    })
+
+
+def log_summary(summary):
+    logging.info(
+        "Done. Processed %s of %s files. %s",
+        sum(summary.values()) - summary[SKIPPED] - summary[QUARANTINED],
+        sum(summary.values()),
+        ", ".join(f"{k}: {v}" for k, v in sorted(summary.items())),
+    )
+
+
+def write_metrics(args, summary, started):
+    """Exports the metrics of the run, if requested"""
+    now = time.time()
+    METRICS.set("last_run_timestamp_seconds", now)
+    METRICS.set("last_run_duration_seconds", now - started)
+    if args.metrics:
+        METRICS.write_prometheus(args.metrics)
+    if args.summary:
+        METRICS.write_json(args.summary, started=started, seconds=now - started, files=summary)
+
+
+def watch(args, configs, manifest, options=DEFAULT_OPTIONS, quarantine=None):
+    """Fixes exports as soon as Dataverse rewrites them. Runs until
+    interrupted, the rules and parser stay loaded between events.
+    If the rules of a format are edited, all files are processed again.
+    """
+    # Stop cleanly on SIGTERM, e.g. from systemd
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    names = export_names(configs)
+    w = watcher(partial(walk, names=names), METADATA_ROOT, names, args.interval, poll=args.poll)
+    try:
+        for batch in debounced(w, args.debounce, idle=args.interval):
+            # Every format is reloaded, even if an earlier one changed
+            if any([config.reload() for config in configs.values()]):
+                logging.info("Rules changed, processing all files")
+                manifest = Manifest(args.state, rules_hash(configs))
+                batch = sharded(find_exports(METADATA_ROOT, names), args.shard)
+            elif batch := list(sharded(batch, args.shard)):
+                logging.info("Detected %s changed files", len(batch))
+            else:
+                continue
+            started = time.time()
+            checked = compliance.Report()
+            summary = run(
+                batch, configs, manifest, options=options, checked=checked, quarantine=quarantine
+            )
+            log_summary(summary)
+            write_metrics(args, summary, started)
+            if args.compliance:
+                checked.write(args.compliance)
+    except KeyboardInterrupt:
+        pass
+    logging.info("Stopped watching")
+
+
+def export_names(configs):
+    """File names of the exports of the formats in configs"""
+    return {FORMATS[name].export for name in configs}
+
+
+def restore(archive, run_id=None, folder=None, dry_run=False):
+    """Writes the originals of the archive back, of one run or the last
+    ones Dataverse wrote, optionally only below folder. Files changed
+    since the proxy wrote them are left alone. Returns the number of
+    restored and skipped files.
+    """
+    restored = skipped = 0
+    entries = archive.originals(run_id, folder)
+    for chunk in chunks(entries, CHUNK_SIZE):
+        with AtomicWriter() as writer:
+            for filename, original, output in chunk:
+                try:
+                    current = file_state(filename)[2]
+                except OSError:
+                    current = None
+                if current == original:
+                    continue  # restored before
+                if current != output:
+                    logging.warning("Not restoring %s, it changed since the proxy wrote it", filename)
+                    skipped += 1
+                    continue
+                logging.info("Restoring %s", filename)
+                if not dry_run:
+                    writer.write(filename, archive.read(original))
+                restored += 1
+            failed = writer.flush()
+        for filename in failed:
+            logging.error("Cannot restore %s", filename)
+        restored -= len(failed)
+        skipped += len(failed)
+    return restored, skipped
+
+
+def dataset_folder(value):
+    """A dataset folder, absolute or relative to the files/ folder"""
+    folder = Path(value)
+    if not folder.is_absolute():
+        folder = METADATA_ROOT / FILES_DIR / folder
+    return str(folder)
+
+
+def format_list(value):
+    """Parses comma separated format names, e.g. oai_ddi,ddi"""
+    names = [v.strip() for v in value.split(",") if v.strip()]
+    unknown = [n for n in names if n not in FORMATS]
+    if unknown or not names:
+        raise argparse.ArgumentTypeError(
+            f"unknown format '{','.join(unknown)}', expected some of {','.join(FORMATS)}"
+        )
+    return names
+
+
+def shard_spec(value):
+    """Parses a shard given as i/n, e.g. 2/4"""
+    try:
+        i, n = (int(v) for v in value.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected i/n, e.g. 2/4, got '{value}'")
+    if not 1 <= i <= n:
+        raise argparse.ArgumentTypeError(f"shard {i} is not between 1 and {n}")
+    return i, n
+
+
+def quarantine_file(state):
+    """The quarantine next to a state file, e.g. state.quarantine.json"""
+    state = Path(state)
+    return str(state.with_name(f"{state.stem}.quarantine{state.suffix}"))
+
+
+def shard_state(state, shard):
+    """The state file of a shard, e.g. state.2-of-4.json"""
+    i, n = shard
+    state = Path(state)
+    return str(state.with_name(f"{state.stem}.{i}-of-{n}{state.suffix}"))
+
+
+def main(args):
+    p = argparse.ArgumentParser(
+        description="Adds missing elements and attributes to Dataverse's metadata exports"
+    )
+    p.add_argument(
+        "--formats",
+        type=format_list,
+        default=[OAI_DDI.name],
+        help=f"Comma separated export formats to fix, some of {','.join(FORMATS)}. By default only oai_ddi",
+    )
+    p.add_argument(
+        "--full",
+        action="store_true",
+        help="Process all files, even if unchanged since the last run",
+    )
+    p.add_argument(
+        "--state",
+        default=str(STATE),
+        help="The location of the per-file state manifest",
+    )
+    p.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of worker processes",
+    )
+    p.add_argument(
+        "--io-threads",
+        type=int,
+        default=0,
+        help="Threads per process reading exports ahead, e.g. on network storage. 0 disables it",
+    )
+    p.add_argument(
+        "--read-ahead",
+        type=int,
+        default=32,
+        help="With --io-threads, number of exports read ahead and kept in memory",
+    )
+    p.add_argument(
+        "--write-behind",
+        type=int,
+        default=2,
+        help=f"With --io-threads, number of batches of {CHUNK_SIZE} files waiting to be written",
+    )
+    p.add_argument(
+        "--watch",
+        action="store_true",
+        help="Keep running and process exports as soon as they are written",
+    )
+    p.add_argument(
+        "--poll",
+        action="store_true",
+        help="In watch mode, poll for changes instead of using inotify",
+    )
+    p.add_argument(
+        "--interval",
+        type=float,
+        default=60,
+        help="Seconds between two scans when polling",
+    )
+    p.add_argument(
+        "--debounce",
+        type=float,
+        default=2,
+        help="Seconds a file must be left untouched before it is processed",
+    )
+    p.add_argument(
+        "--serve",
+        action="store_true",
+        help="Run as OAI-PMH proxy in front of Dataverse instead of fixing files",
+    )
+    p.add_argument(
+        "--upstream",
+        default=UPSTREAM,
+        help="The Dataverse OAI endpoint to proxy",
+    )
+    p.add_argument("--host", default="127.0.0.1", help="Address the proxy listens on")
+    p.add_argument("--port", type=int, default=8000, help="Port the proxy listens on")
+    p.add_argument(
+        "--cache-size",
+        type=int,
+        default=1000,
+        help="Number of transformed records kept in memory",
+    )
+    p.add_argument(
+        "-n",
+        "--dry-run",
+        action="store_true",
+        help="Report which rules would change each file without writing anything",
+    )
+    p.add_argument(
+        "--stream",
+        action="store_true",
+        help="Copy sections no rule points into (e.g. dataDscr) through without parsing them",
+    )
+    p.add_argument(
+        "--metrics",
+        help="Write metrics in Prometheus' textfile format to this file",
+    )
+    p.add_argument(
+        "--summary",
+        help="Write a json summary of the run to this file",
+    )
+    p.add_argument(
+        "--rule-timings",
+        action="store_true",
+        help="Time every rule and special case in the metrics, this slows processing down",
+    )
+    p.add_argument(
+        "--transform-cache",
+        default=str(TRANSFORMS),
+        help="The location of the cache of transformed exports",
+    )
+    p.add_argument(
+        "--transform-cache-mb",
+        type=float,
+        default=512,
+        help="Maximum size of the transform cache in MB, 0 disables it",
+    )
+    p.add_argument(
+        "--shard",
+        type=shard_spec,
+        help="Only process shard i of n, e.g. 2/4, to split the exports across hosts",
+    )
+    p.add_argument(
+        "--time-budget",
+        type=float,
+        default=300,
+        help="Seconds a single file may take before it is stopped and quarantined, 0 disables it",
+    )
+    p.add_argument(
+        "--memory-budget-mb",
+        type=float,
+        default=2048,
+        help="Memory in MB a single file may use before it is stopped and quarantined, 0 disables it. "
+        "With --io-threads, the exports read ahead meanwhile count as well",
+    )
+    p.add_argument(
+        "--max-file-mb",
+        type=float,
+        default=1024,
+        help="Exports larger than this are quarantined without reading them, 0 disables it",
+    )
+    p.add_argument(
+        "--quarantine",
+        help="The location of the quarantine list, by default next to the state file",
+    )
+    p.add_argument(
+        "--retry-quarantined",
+        action="store_true",
+        help="Process quarantined files again, even if unchanged",
+    )
+    p.add_argument(
+        "--archive",
+        default=str(ORIGINALS),
+        help="The location of the archive of original exports",
+    )
+    p.add_argument(
+        "--no-archive",
+        action="store_true",
+        help="Do not keep the originals of changed exports",
+    )
+    p.add_argument(
+        "--restore",
+        action="store_true",
+        help="Write the originals of changed exports back instead of processing them",
+    )
+    p.add_argument(
+        "--run",
+        help="With --restore, only restore the files changed by this run",
+    )
+    p.add_argument(
+        "--dataset",
+        type=dataset_folder,
+        help="With --restore, only restore the exports below this dataset folder",
+    )
+    p.add_argument(
+        "--compliance",
+        help="Write a json report of the files that do not meet the profile to this file",
+    )
+    p.add_argument(
+        "--log-level",
+        default="INFO",
+        choices=["DEBUG", "INFO", "WARNING", "ERROR"],
+        help="Level of the messages written to proxy.log",
+    )
+    args = p.parse_args(args)
+    logs.setup(LOG, level=args.log_level)
+
+    # The OAI proxy only serves DDI records
+    formats = [OAI_DDI.name] if args.serve else args.formats
+    try:
+        configs = {name: load_config(FORMATS[name]) for name in formats}
+    except ConfigError as e:
+        # Nothing was touched yet
+        logging.error("%s", e)
+        sys.exit(str(e))
+
+    if args.serve:
+        config = configs[OAI_DDI.name]
+        proxy = Proxy(
+            args.upstream,
+            lambda xml: apply_rules(xml, config.rules),
+            args.cache_size,
+            reload=config.reload,
+        )
+        serve(proxy, args.host, args.port)
+        return
+
+    if args.shard is not None:
+        args.state = shard_state(args.state, args.shard)
+    # One run per state file, e.g. the cron job of one shard
+    lock = Lock(args.state + ".lock")
+    if not lock.acquire():
+        logging.warning("Another run holds %s.lock, exiting", args.state)
+        return
+
+    try:
+        if args.restore:
+            archive = Archive(args.archive)
+            restored, skipped = restore(archive, args.run, args.dataset, args.dry_run)
+            done = "Would restore" if args.dry_run else "Restored"
+            logging.info("%s %s files, skipped %s", done, restored, skipped)
+            print(f"{done} {restored} files, skipped {skipped}")
+            return
+
+        if args.shard is not None:
+            logging.info("Starting run of shard %s/%s", *args.shard)
+        else:
+            logging.info("Starting run")
+        started = time.time()
+        METRICS.reset()
+        manifest = Manifest(args.state, rules_hash(configs))
+        checked = compliance.Report()
+        cache = None
+        if args.transform_cache_mb > 0:
+            cache = TransformCache(args.transform_cache, int(args.transform_cache_mb * 1e6))
+        options = Options(
+            args.dry_run,
+            args.stream,
+            cache,
+            None if args.no_archive else Archive(args.archive),
+            IO(args.io_threads, args.read_ahead, args.write_behind),
+            Budget(args.time_budget, args.memory_budget_mb, args.max_file_mb),
+            args.rule_timings,
+        )
+        quarantine = Quarantine(args.quarantine or quarantine_file(args.state))
+        if args.retry_quarantined:
+            quarantine.files.clear()
+        summary = run(
+            sharded(find_exports(METADATA_ROOT, export_names(configs)), args.shard),
+            configs,
+            manifest,
+            args.workers,
+            args.full,
+            options,
+            checked,
+            quarantine,
+        )
+        log_summary(summary)
+        write_metrics(args, summary, started)
+        if args.compliance:
+            checked.write(args.compliance)
+
+        if args.watch:
+            watch(args, configs, manifest, options, quarantine)
+    finally:
+        lock.release()
 
 
 if __name__ == "__main__":
-     main()
+     main(sys.argv[1:])
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+
+# ------------------------------------------------------------------------- #
+# Dependency imports
+# ------------------------------------------------------------------------- #
+
+import json
+import time
+
+from collections import defaultdict
+from contextlib import contextmanager
+
+from writer import write_atomic
+
+# ------------------------------------------------------------------------- #
+# Globals / Defaults
+# ------------------------------------------------------------------------- #
+
+PREFIX = "proxy_"
+
+# Upper bounds of the timing histogram buckets in seconds
+BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, float("inf"))
+
+# ------------------------------------------------------------------------- #
+# Util functions
+# ------------------------------------------------------------------------- #
+
+
+def format_labels(labels, **extra):
+    items = list(labels) + list(extra.items())
+    if not items:
+        return ""
+    escaped = [
+        (k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for k, v in items
+    ]
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+def metric_key(name, labels):
+    return name, tuple(sorted(labels.items())) if labels else ()
+
+
+def format_value(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+# ------------------------------------------------------------------------- #
+# Metrics
+# ------------------------------------------------------------------------- #
+
+
+class Metrics:
+    """Counters and timing histograms of a run, keyed by metric
+    name and labels. Worker processes send snapshots of their
+    metrics to the parent, which merges them. Timings of single rules
+    and hooks are only taken if detailed, they cost about as much as
+    the rules themselves.
+    """
+
+    def __init__(self, detailed=False):
+        self.detailed = detailed
+        self.reset()
+
+    def reset(self):
+        self.counters = defaultdict(float)
+        self.gauges = {}
+        # (name, labels) -> [bucket counts..., sum, count]
+        self.histograms = {}
+
+    def inc(self, name, value=1, **labels):
+        self.counters[metric_key(name, labels)] += value
+
+    def set(self, name, value, **labels):
+        self.gauges[metric_key(name, labels)] = value
+
+    def observe(self, name, seconds, **labels):
+        k = metric_key(name, labels)
+        h = self.histograms.get(k)
+        if h is None:
+            h = self.histograms[k] = [0] * (len(BUCKETS) + 2)
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                h[i] += 1
+                break
+        h[-2] += seconds
+        h[-1] += 1
+
+    @contextmanager
+    def timer(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def snapshot(self):
+        """Returns the metrics collected so far and starts over"""
+        snap = (dict(self.counters), self.histograms)
+        self.reset()
+        return snap
+
+    def merge(self, snap):
+        counters, histograms = snap
+        for key, value in counters.items():
+            self.counters[key] += value
+        for key, h in histograms.items():
+            mine = self.histograms.setdefault(key, [0] * len(h))
+            for i, v in enumerate(h):
+                mine[i] += v
+
+    def prometheus(self):
+        """Returns all metrics in Prometheus' text exposition format"""
+        lines = []
+        for kind, values in (("counter", self.counters), ("gauge", self.gauges)):
+            for name in sorted({n for n, _ in values}):
+                lines.append(f"# TYPE {PREFIX}{name} {kind}")
+                for (n, labels), value in sorted(values.items()):
+                    if n == name:
+                        lines.append(f"{PREFIX}{name}{format_labels(labels)} {format_value(value)}")
+
+        for name in sorted({n for n, _ in self.histograms}):
+            lines.append(f"# TYPE {PREFIX}{name} histogram")
+            for (n, labels), h in sorted(self.histograms.items()):
+                if n != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(BUCKETS, h):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                    lines.append(f"{PREFIX}{name}_bucket{format_labels(labels, le=le)} {cumulative}")
+                lines.append(f"{PREFIX}{name}_sum{format_labels(labels)} {h[-2]:.6f}")
+                lines.append(f"{PREFIX}{name}_count{format_labels(labels)} {h[-1]}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        """Returns counters and timing totals as a json serializable dict"""
+
+        def key(name, labels):
+            return name + format_labels(labels)
+
+        return {
+            "counters": {key(n, l): v for (n, l), v in sorted(self.counters.items())},
+            "gauges": {key(n, l): v for (n, l), v in sorted(self.gauges.items())},
+            "timings": {
+                key(n, l): {"count": h[-1], "seconds": round(h[-2], 6)}
+                for (n, l), h in sorted(self.histograms.items())
+            },
+        }
+
+    def write_prometheus(self, filename):
+        # Atomic, so node-exporter's textfile collector never reads a partial file
+        write_atomic(filename, self.prometheus())
+
+    def write_json(self, filename, **extra):
+        write_atomic(filename, json.dumps({**extra, **self.summary()}, indent=2))
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+
+# ------------------------------------------------------------------------- #
+# Dependency imports
+# ------------------------------------------------------------------------- #
+
+import logging
+import threading
+import time
+
+from collections import deque
+from contextlib import contextmanager
+
+from writer import AtomicWriter
+
+# ------------------------------------------------------------------------- #
+# Stages
+# ------------------------------------------------------------------------- #
+
+
+class Stage:
+    """Busy time of a pipeline stage, summed over its threads. Compared
+    to the time its threads were available, it tells which stage limits
+    a run, e.g. a read stage busy all the time on slow storage.
+    """
+
+    def __init__(self, name, threads=1):
+        self.name = name
+        self.threads = threads
+        self.busy = 0.0
+        self.lock = threading.Lock()
+
+    def add(self, seconds):
+        with self.lock:
+            self.busy += seconds
+
+    @contextmanager
+    def timed(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(time.perf_counter() - start)
+
+    def utilisation(self, seconds):
+        """Share of the time the stage's threads were busy"""
+        return self.busy / (seconds * self.threads) if seconds > 0 else 0.0
+
+
+def prefetch(items, read, pool, depth, stage):
+    """Yields (item, future) of read(item) for every item, in order.
+    Up to depth items are read ahead in the threads of pool, so the
+    results of one item wait in memory while the ones before it are
+    processed.
+    """
+
+    def task(item):
+        with stage.timed():
+            return read(item)
+
+    pending = deque()
+    for item in items:
+        pending.append((item, pool.submit(task, item)))
+        if len(pending) >= depth:
+            yield pending.popleft()
+    while pending:
+        yield pending.popleft()
+
+
+# ------------------------------------------------------------------------- #
+# Writer stage
+# ------------------------------------------------------------------------- #
+
+
+class DeferredWriter:
+    """Collects the writes of a batch in memory. They are written to
+    temp files and replace the originals on flush, so a writer thread
+    can do all of a batch's I/O while the next batch is transformed.
+    """
+
+    def __init__(self):
+        self.pending = []  # (filename, data)
+
+    def write(self, filename, data):
+        self.pending.append((str(filename), data))
+
+    def flush(self):
+        """Writes and replaces all files. Returns the files that could
+        not be written or replaced, their originals are left untouched.
+        """
+        failed = set()
+        pending, self.pending = self.pending, []
+        writer = AtomicWriter()
+        try:
+            for filename, data in pending:
+                try:
+                    writer.write(filename, data)
+                except OSError as e:
+                    logging.error("Cannot write %s: %s", filename, e)
+                    failed.add(filename)
+        except BaseException:
+            writer.discard()
+            raise
+        return failed | writer.flush()
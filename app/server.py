@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+
+# ------------------------------------------------------------------------- #
+# Dependency imports
+# ------------------------------------------------------------------------- #
+
+import asyncio
+import copy
+import logging
+import threading
+
+from collections import OrderedDict
+from urllib.error import HTTPError, URLError
+from urllib.parse import parse_qs, urlsplit
+from urllib.request import urlopen
+
+from lxml import etree
+
+# ------------------------------------------------------------------------- #
+# Globals / Defaults
+# ------------------------------------------------------------------------- #
+
+OAI = "{http://www.openarchives.org/OAI/2.0/}"
+DDI = "{ddi:codebook:2_5}"
+
+TRANSFORM_VERBS = {"GetRecord", "ListRecords"}
+
+# Responses come from the network, never resolve entities or load DTDs
+RESPONSE_PARSER = etree.XMLParser(remove_blank_text=True, resolve_entities=False, no_network=True)
+
+REASONS = {200: "OK", 400: "Bad Request", 405: "Method Not Allowed", 502: "Bad Gateway"}
+
+# ------------------------------------------------------------------------- #
+# Record cache
+# ------------------------------------------------------------------------- #
+
+
+class RecordCache:
+    """Bounded LRU cache of transformed codeBook elements,
+    keyed by record identifier and datestamp.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.records = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        record = self.records.get(key)
+        if record is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.records.move_to_end(key)
+        return record
+
+    def put(self, key, record):
+        self.records[key] = record
+        self.records.move_to_end(key)
+        while len(self.records) > self.size:
+            self.records.popitem(last=False)
+
+    def clear(self):
+        self.records.clear()
+
+
+# ------------------------------------------------------------------------- #
+# Proxy
+# ------------------------------------------------------------------------- #
+
+
+class Proxy:
+    """Passes OAI-PMH requests to Dataverse and applies the rules
+    to every DDI record of GetRecord and ListRecords responses.
+    """
+
+    def __init__(self, upstream, transform, cache_size=1000, timeout=60, reload=None):
+        self.upstream = upstream
+        self.transform = transform  # applies the rules to a codeBook tree in place
+        self.reload = reload  # returns True if the rules changed
+        self.cache = RecordCache(cache_size)
+        self.timeout = timeout
+        self.lock = threading.Lock()  # responses are fixed in executor threads
+
+    def fetch(self, query):
+        """Requests the upstream OAI endpoint, returns status, content type and body"""
+        url = self.upstream + ("?" + query if query else "")
+        try:
+            with urlopen(url, timeout=self.timeout) as r:
+                return r.status, r.headers.get("Content-Type", "text/xml"), r.read()
+        except HTTPError as e:
+            return e.code, e.headers.get("Content-Type", "text/xml"), e.read()
+
+    def fix_record(self, record):
+        header = record.find(OAI + "header")
+        codebook = record.find(OAI + "metadata/" + DDI + "codeBook")
+        if header is None or codebook is None:  # e.g. deleted records
+            return
+
+        key = (header.findtext(OAI + "identifier"), header.findtext(OAI + "datestamp"))
+        fixed = self.cache.get(key)
+        if fixed is None:
+            # Rules are applied to the record on its own, so that
+            # their xpaths cannot match elements of other records
+            fixed = copy.deepcopy(codebook)
+            self.transform(etree.ElementTree(fixed))
+            self.cache.put(key, fixed)
+        codebook.getparent().replace(codebook, copy.deepcopy(fixed))
+
+    def fix_response(self, body):
+        """Returns the response with the rules applied to every record.
+        Blocks for as long as the page takes, so it runs in an executor
+        thread. The rules and the cache are used by one thread at a time.
+        """
+        doc = etree.fromstring(body, parser=RESPONSE_PARSER)
+        with self.lock:
+            if self.reload is not None and self.reload():
+                self.cache.clear()  # records transformed with the old rules
+            for record in doc.iterfind(OAI + "*/" + OAI + "record"):
+                self.fix_record(record)
+        return etree.tostring(doc, xml_declaration=True, encoding="UTF-8")
+
+    async def read_query(self, reader):
+        """Reads an HTTP request, returns its method and OAI query"""
+        method, target, _ = (await reader.readline()).decode("latin-1").split(" ", 2)
+        length = 0
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            if name.strip().lower() == "content-length":
+                length = int(value)
+
+        # OAI-PMH allows the query in the body of POST requests
+        query = urlsplit(target).query
+        if method == "POST" and length > 0:
+            query = (await reader.readexactly(length)).decode("utf-8")
+        return method, query
+
+    async def handle(self, reader, writer):
+        ctype = "text/plain; charset=utf-8"
+        try:
+            method, query = await self.read_query(reader)
+            if method not in ("GET", "POST"):
+                status, body = 405, b"Method not allowed"
+            else:
+                loop = asyncio.get_running_loop()
+                status, ctype, body = await loop.run_in_executor(None, self.fetch, query)
+                verb = parse_qs(query).get("verb", [None])[0]
+                if status == 200 and verb in TRANSFORM_VERBS:
+                    try:
+                        body = await loop.run_in_executor(None, self.fix_response, body)
+                    except etree.XMLSyntaxError:
+                        logging.error("XMLSyntaxError in upstream response to %s", query)
+        except (ValueError, asyncio.IncompleteReadError):
+            status, body = 400, b"Bad request"
+        except (URLError, OSError) as e:
+            logging.error("Upstream %s unavailable: %s", self.upstream, e)
+            status, body = 502, b"Upstream unavailable"
+
+        head = (
+            f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+            f"Content-Type: {ctype}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Connection: close\r\n\r\n"
+        )
+        writer.write(head.encode("latin-1") + body)
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+
+async def serve_forever(proxy, host, port):
+    server = await asyncio.start_server(proxy.handle, host, port)
+    logging.info("Proxying %s on %s:%s", proxy.upstream, host, port)
+    async with server:
+        await server.serve_forever()
+
+
+def serve(proxy, host, port):
+    """Runs the proxy until interrupted"""
+    try:
+        asyncio.run(serve_forever(proxy, host, port))
+    except KeyboardInterrupt:
+        pass
+    logging.info(
+        "Stopped proxy. Cache hits: %s, misses: %s", proxy.cache.hits, proxy.cache.misses
+    )
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+
+# ------------------------------------------------------------------------- #
+# Dependency imports
+# ------------------------------------------------------------------------- #
+
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import time
+
+from writer import write_atomic
+
+# ------------------------------------------------------------------------- #
+# Util functions
+# ------------------------------------------------------------------------- #
+
+
+def hash_file(filename, chunk_size=1 << 20):
+    """Returns the sha256 hex digest of a file's content"""
+    h = hashlib.sha256()
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def file_state(filename, digest=None):
+    """Returns the manifest entry of a file: mtime, size and content
+    hash. The file is only read if the hash of its content is not given.
+    """
+    st = os.stat(filename)
+    return [st.st_mtime_ns, st.st_size, digest if digest is not None else hash_file(filename)]
+
+
+# ------------------------------------------------------------------------- #
+# State manifest
+# ------------------------------------------------------------------------- #
+
+
+class Manifest:
+    """Per-file state of previous runs, keyed by path.
+
+    Every entry records mtime, size and content hash of a file as the proxy
+    left it. Together with the hash of the defaults file it allows a run to
+    skip files that have not been re-exported since they were processed.
+    """
+
+    def __init__(self, filename, rules_hash):
+        self.filename = str(filename)
+        self.rules_hash = rules_hash
+        self.files = {}
+        self.seen = {}
+
+        try:
+            with open(self.filename, encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            logging.info("No state manifest at %s, processing all files", self.filename)
+            return
+        except (OSError, ValueError):
+            logging.warning("State manifest %s unreadable, processing all files", self.filename)
+            return
+
+        if data.get("rules") != rules_hash:
+            logging.info("Defaults changed since last run, processing all files")
+            return
+        self.files = data.get("files", {})
+
+    def is_current(self, filename):
+        """True if the file is unchanged since the proxy last processed it.
+        Files removed meanwhile are not, processing skips them.
+        """
+        filename = str(filename)
+        entry = self.seen.get(filename) or self.files.get(filename)
+        if entry is None:
+            return False
+
+        mtime, size, digest = entry
+        try:
+            st = os.stat(filename)
+            if st.st_size != size:
+                return False
+            if st.st_mtime_ns != mtime:
+                # Touched, but possibly rewritten with the same content
+                if hash_file(filename) != digest:
+                    return False
+                entry = [st.st_mtime_ns, size, digest]
+        except FileNotFoundError:
+            return False
+        self.seen[filename] = entry
+        return True
+
+    def update(self, filename, state=None):
+        """Records the state of a processed file"""
+        filename = str(filename)
+        self.seen[filename] = state if state is not None else file_state(filename)
+
+    def save(self):
+        """Writes the state of all files seen in this run"""
+        data = {"rules": self.rules_hash, "files": self.seen}
+        write_atomic(self.filename, json.dumps(data, separators=(",", ":")))
+
+
+class Quarantine:
+    """Exports that could not be processed, keyed by path.
+
+    Every entry records the state of the file, why it failed and since
+    when. A quarantined file is skipped until its content changes, so
+    that one broken or pathological export does not fail every run.
+    """
+
+    def __init__(self, filename):
+        self.filename = str(filename)
+        self.files = {}
+        try:
+            with open(self.filename, encoding="utf-8") as f:
+                self.files = json.load(f)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError):
+            logging.warning("Quarantine %s unreadable, retrying all files", self.filename)
+
+    def holds(self, filename):
+        """True if the file is quarantined and unchanged since. Files
+        removed meanwhile are not.
+        """
+        entry = self.files.get(str(filename))
+        if entry is None:
+            return False
+        mtime, size, digest = entry["state"]
+        try:
+            st = os.stat(filename)
+            if st.st_size != size:
+                return False
+            if st.st_mtime_ns != mtime:
+                return hash_file(filename) == digest
+        except FileNotFoundError:
+            return False
+        return True
+
+    def add(self, filename, reason):
+        filename = str(filename)
+        try:
+            state = file_state(filename)
+        except OSError:
+            return  # removed meanwhile, nothing to skip
+        since = self.files.get(filename, {}).get("since", time.time())
+        self.files[filename] = {"state": state, "reason": reason, "since": since}
+
+    def release(self, filename):
+        """Removes a file, returns True if it was quarantined"""
+        return self.files.pop(str(filename), None) is not None
+
+    def save(self):
+        """Writes the entries of all files that still exist"""
+        files = {f: e for f, e in self.files.items() if os.path.exists(f)}
+        write_atomic(self.filename, json.dumps(files, indent=1))
+
+
+class Lock:
+    """Exclusive lock on a file, so that two runs never share a
+    state file. Released when the process exits at the latest.
+    """
+
+    def __init__(self, filename):
+        self.filename = str(filename)
+        self.file = None
+
+    def acquire(self):
+        """Takes the lock, returns False if another process holds it"""
+        self.file = open(self.filename, "a")
+        try:
+            fcntl.flock(self.file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self.file.close()
+            self.file = None
+            return False
+        return True
+
+    def release(self):
+        if self.file is not None:
+            fcntl.flock(self.file, fcntl.LOCK_UN)
+            self.file.close()
+            self.file = None
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+
+# ------------------------------------------------------------------------- #
+# Dependency imports
+# ------------------------------------------------------------------------- #
+
+import os
+import sqlite3
+
+# ------------------------------------------------------------------------- #
+# SQLite store
+# ------------------------------------------------------------------------- #
+
+
+class SQLiteStore:
+    """Base of the proxy's SQLite files, e.g. the archive. The schema
+    is created on the first connection.
+
+    Every process opens its own connection, so a store can be shared
+    by worker processes.
+    """
+
+    schema = ""
+
+    def __init__(self, filename):
+        self.filename = str(filename)
+        self.db = None
+        self.pid = None
+
+    def connect(self):
+        if self.db is None or self.pid != os.getpid():
+            self.db = sqlite3.connect(self.filename, timeout=30, isolation_level=None)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.executescript(self.schema)
+            self.pid = os.getpid()
+            self.connected()
+        return self.db
+
+    def connected(self):
+        """Called with every new connection"""
+
+    def __getstate__(self):
+        # Sent to worker processes, which open their own connection
+        return {**self.__dict__, "db": None, "pid": None}
+
+    def close(self):
+        if self.db is not None and self.pid == os.getpid():
+            self.db.close()
+        self.db = None
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+
+# ------------------------------------------------------------------------- #
+# Dependency imports
+# ------------------------------------------------------------------------- #
+
+import mmap
+import re
+
+from lxml import etree
+
+# ------------------------------------------------------------------------- #
+# Globals / Defaults
+# ------------------------------------------------------------------------- #
+
+# Large sections of a codeBook that can be copied through unchanged
+SECTIONS = ("fileDscr", "dataDscr")
+
+PLACEHOLDER = "proxy-section"
+PLACEHOLDER_RE = re.compile(rb"<\?" + PLACEHOLDER.encode() + rb" (\d+)\?>")
+
+COPY_SIZE = 1 << 20  # bytes copied at once
+
+# ------------------------------------------------------------------------- #
+# Split and join
+# ------------------------------------------------------------------------- #
+
+
+def section_ranges(mm, tag):
+    """Yields (start, end) byte ranges of all non-empty tag elements"""
+    start_re = re.compile(rb"<(?:[\w.-]+:)?" + tag.encode() + rb"[\s>]")
+    end_re = re.compile(rb"</(?:[\w.-]+:)?" + tag.encode() + rb"\s*>")
+    pos = 0
+    while True:
+        start = start_re.search(mm, pos)
+        if start is None:
+            return
+        end = end_re.search(mm, start.end())
+        if end is None:
+            return
+        yield start.start(), end.end()
+        pos = end.end()
+
+
+def split(filename, tags):
+    """Reads an export without the given sections. Returns its
+    bytes, with a placeholder instead of every section, and the
+    byte ranges of the sections. Only the returned bytes are loaded
+    into memory.
+    """
+    with open(filename, "rb") as f:
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # empty file
+            return f.read(), []
+
+        with mm:
+            ranges = sorted(r for tag in tags for r in section_ranges(mm, tag))
+            parts, pos = [], 0
+            for i, (start, end) in enumerate(ranges):
+                if start < pos:  # overlapping, e.g. inside of CDATA
+                    return mm[:], []
+                parts.append(mm[pos:start])
+                parts.append(f"<?{PLACEHOLDER} {i}?>".encode())
+                pos = end
+            parts.append(mm[pos:])
+    return b"".join(parts), ranges
+
+
+def streamable(rules, sections=SECTIONS):
+    """Returns the sections no rule path points into"""
+    return [t for t in sections if not any(r.startswith(f"/codeBook/{t}") for r in rules)]
+
+
+def placeholders_ok(xml, ranges):
+    """True if every placeholder ended up directly below the codeBook.
+    Otherwise a section was found in an unexpected place, e.g. in a
+    comment, and the file has to be processed as a whole.
+    """
+    found = 0
+    for pi in xml.iter(etree.PI):
+        if pi.target == PLACEHOLDER:
+            parent = pi.getparent()
+            if parent is None or etree.QName(parent).localname != "codeBook":
+                return False
+            found += 1
+    return found == len(ranges)
+
+
+def join(serialized, filename, ranges):
+    """Yields the serialized export with every placeholder replaced
+    by the original bytes of its section, copied from filename.
+    """
+    with open(filename, "rb") as f:
+        pos = 0
+        for m in PLACEHOLDER_RE.finditer(serialized):
+            yield serialized[pos : m.start()]
+            start, end = ranges[int(m.group(1))]
+            f.seek(start)
+            remaining = end - start
+            while remaining > 0:
+                chunk = f.read(min(COPY_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+            pos = m.end()
+        yield serialized[pos:]
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+
+# ------------------------------------------------------------------------- #
+# Dependency imports
+# ------------------------------------------------------------------------- #
+
+import logging
+import os
+import time
+
+from pathlib import Path
+
+try:
+    from inotify_simple import INotify, flags
+except ImportError:  # optional, fall back to polling
+    INotify = None
+
+# ------------------------------------------------------------------------- #
+# Watchers
+# ------------------------------------------------------------------------- #
+
+
+class PollingWatcher:
+    """Finds changed exports by comparing mtime and size of all
+    exports between two walks of the metadata root.
+    """
+
+    def __init__(self, walk, root, interval):
+        self.walk = walk  # yields (directory, depth, exports) below a folder
+        self.root = root
+        self.interval = interval
+        self.snapshot = self.scan()
+
+    def scan(self):
+        snapshot = {}
+        for _, _, exports in self.walk(self.root):
+            for filename in exports:
+                try:
+                    st = os.stat(filename)
+                except OSError:
+                    continue
+                snapshot[filename] = (st.st_mtime_ns, st.st_size)
+        return snapshot
+
+    def read(self, timeout=None):
+        """Returns the exports that changed since the last call"""
+        time.sleep(self.interval)
+        snapshot = self.scan()
+        changed = [f for f, s in snapshot.items() if self.snapshot.get(f) != s]
+        self.snapshot = snapshot
+        return changed
+
+
+class InotifyWatcher:
+    """Receives changed exports from inotify. Every folder that can
+    hold exports is watched, new folders are added as they appear.
+    """
+
+    def __init__(self, walk, root, exports):
+        self.walk = walk  # yields (directory, depth, exports) below a folder
+        self.exports = exports  # file names of the exports
+        self.inotify = INotify()
+        self.dirs = {}
+        self.mask = flags.CLOSE_WRITE | flags.MOVED_TO | flags.CREATE
+        self.add(root)
+
+    def add(self, top, in_files=False, depth=0):
+        """Watches top and the folders below it, returns the exports found"""
+        exports = []
+        for path, d, found in self.walk(top, in_files, depth):
+            # Raises OSError once the inotify watch limit is reached
+            wd = self.inotify.add_watch(str(path), self.mask)
+            self.dirs[wd] = (Path(path), d)
+            exports.extend(found)
+        return exports
+
+    def read(self, timeout=None):
+        """Returns the exports written since the last call, waits at
+        most timeout seconds (forever if None) for the first event.
+        """
+        changed = []
+        ms = None if timeout is None else int(timeout * 1000)
+        for event in self.inotify.read(timeout=ms):
+            if event.mask & flags.IGNORED:
+                self.dirs.pop(event.wd, None)
+                continue
+            if event.wd not in self.dirs:
+                continue
+            path, depth = self.dirs[event.wd]
+            if event.mask & flags.ISDIR:
+                if event.mask & (flags.CREATE | flags.MOVED_TO):
+                    # New dataset folder, may already contain exports
+                    changed.extend(self.add(path / event.name, True, depth + 1))
+            elif event.name in self.exports:
+                changed.append(path / event.name)
+        return changed
+
+
+def watcher(walk, root, exports, interval, poll=False):
+    """Returns an inotify watcher if available, a polling watcher otherwise"""
+    if INotify is not None and not poll:
+        try:
+            w = InotifyWatcher(walk, root, exports)
+            logging.info("Watching %s folders with inotify", len(w.dirs))
+            return w
+        except OSError as e:
+            logging.warning("Cannot use inotify (%s), falling back to polling", e)
+    logging.info("Polling for changed exports every %s seconds", interval)
+    return PollingWatcher(walk, root, interval)
+
+
+def debounced(w, debounce, idle=None):
+    """Yields batches of exports that were not written to for at
+    least debounce seconds, so that each burst of writes from
+    Dataverse is processed once. With idle, an empty batch is
+    yielded after idle seconds without changes.
+    """
+    pending = {}
+    while True:
+        timeout = debounce if pending else idle
+        changed = w.read(timeout)
+        for filename in changed:
+            pending[filename] = time.monotonic()
+
+        now = time.monotonic()
+        ready = [f for f, t in pending.items() if now - t >= debounce]
+        for f in ready:
+            del pending[f]
+        if ready:
+            yield ready
+        elif idle is not None and not changed and not pending:
+            yield []
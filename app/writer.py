@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+
+# ------------------------------------------------------------------------- #
+# Dependency imports
+# ------------------------------------------------------------------------- #
+
+import logging
+import os
+import tempfile
+
+# ------------------------------------------------------------------------- #
+# Globals / Defaults
+# ------------------------------------------------------------------------- #
+
+UMASK = os.umask(0)
+os.umask(UMASK)
+
+# ------------------------------------------------------------------------- #
+# Atomic writer
+# ------------------------------------------------------------------------- #
+
+
+class AtomicWriter:
+    """Replaces files atomically. Data goes to a temp file in the same
+    folder, which replaces the original once it is on disk, so readers
+    never see a truncated export. Temp files are fsynced in batches,
+    followed by the renames and one fsync per folder.
+    """
+
+    def __init__(self, fsync=True):
+        self.fsync = fsync
+        self.pending = []  # (temp file, original)
+
+    def write(self, filename, data):
+        """Writes bytes, or an iterable of bytes, to a temp file that
+        will replace filename on flush.
+        """
+        filename = str(filename)
+        folder, name = os.path.split(filename)
+        fd, tmp = tempfile.mkstemp(prefix=f".{name}.", suffix=".tmp", dir=folder or ".")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                if isinstance(data, bytes):
+                    f.write(data)
+                else:
+                    for chunk in data:
+                        f.write(chunk)
+            self.copy_permissions(filename, tmp)
+        except OSError:
+            os.unlink(tmp)
+            raise
+        self.pending.append((tmp, filename))
+
+    @staticmethod
+    def copy_permissions(src, dst):
+        # mkstemp creates files only readable by us, Dataverse must read them
+        try:
+            st = os.stat(src)
+        except FileNotFoundError:
+            os.chmod(dst, 0o666 & ~UMASK)  # new files, as open() creates them
+            return
+        os.chmod(dst, st.st_mode & 0o7777)
+        if hasattr(os, "chown") and (st.st_uid, st.st_gid) != (os.getuid(), os.getgid()):
+            try:
+                os.chown(dst, st.st_uid, st.st_gid)
+            except PermissionError:
+                pass
+
+    def flush(self):
+        """Moves all pending files in place. Returns the files that
+        could not be replaced, their originals are left untouched.
+        """
+        failed = set()
+        pending, self.pending = self.pending, []
+
+        if self.fsync:
+            for tmp, filename in pending:
+                try:
+                    fd = os.open(tmp, os.O_RDONLY)
+                    try:
+                        os.fsync(fd)
+                    finally:
+                        os.close(fd)
+                except OSError as e:
+                    logging.error("Cannot sync %s: %s", tmp, e)
+                    failed.add(filename)
+
+        folders = set()
+        for tmp, filename in pending:
+            try:
+                if filename not in failed:
+                    os.replace(tmp, filename)
+                    folders.add(os.path.dirname(filename) or ".")
+                    continue
+            except OSError as e:
+                logging.error("Cannot replace %s: %s", filename, e)
+                failed.add(filename)
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+
+        # Persist the renames
+        if self.fsync:
+            for folder in folders:
+                try:
+                    fd = os.open(folder, os.O_RDONLY)
+                    try:
+                        os.fsync(fd)
+                    finally:
+                        os.close(fd)
+                except OSError:
+                    pass  # not supported by every file system
+        return failed
+
+    def discard(self):
+        """Removes all pending temp files"""
+        for tmp, _ in self.pending:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+        self.pending = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.flush()
+        else:
+            self.discard()
+
+
+def write_atomic(filename, data):
+    """Replaces a single file atomically with bytes or text, e.g. a
+    state or report file. Raises OSError if it cannot be replaced.
+    """
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    writer = AtomicWriter()
+    writer.write(filename, data)
+    if writer.flush():
+        raise OSError(f"Cannot replace {filename}")
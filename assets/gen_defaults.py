@@ -4,51 +4,34 @@ import argparse
 import json
 import sys
 from os import path
+from pathlib import Path
 
-from lxml import etree
+root = Path(__file__).parent.parent
+sys.path.insert(0, str(root / "app"))
+
+import ddi_profile  # noqa: E402
 
 
 def gen_rules(
-    constraint: str = "Mandatory", profile: str = "assets/cdc25_profile_mono.xml"
+    constraint: tuple = ("Mandatory",), profile: str = "assets/cdc25_profile_mono.xml"
 ) -> None:
     """
     Generator yielding all xpaths for specified constraint.
 
     Parameters:
-    constraint (str): one of ["Mandatory", "Optional", "Recommended"]
+    constraint (tuple): of ["Mandatory", "Optional", "Recommended"]
     profile (str): local file name
     """
 
     # Ensure that parameters are valid
-    assert all(
-        True for c in constraint if c in ["Mandatory", "Optional", "Recommended"]
-    )
+    assert all(c in ["Mandatory", "Optional", "Recommended"] for c in constraint)
     assert path.isfile(profile)
 
-    # Parse file as xml
-    xml_parser = etree.XMLParser(
-        remove_blank_text=True,
-        remove_comments=True,
-        load_dtd=True,
-        attribute_defaults=True,
-        ns_clean=True,
-    )
-    profile = etree.parse(profile, parser=xml_parser)
-    # Namespaces so query can be placed
-    profile_nsmap = profile.getroot().nsmap
-    # Query all rules
-    profile_rules = profile.findall("//pr:Used", namespaces=profile_nsmap)
-
-    # Iterate over fields in rule, if constraint is there, return xpath
-    for rule in profile_rules:
-        for field in rule.itertext():
-            for c in constraint:
-                if f"Required: {c}" in field:
-                    yield rule.attrib["xpath"]
+    yield from ddi_profile.with_constraint(ddi_profile.load(profile), constraint)
 
 
 def gen_rules_defaults(
-    constraint: str = "Mandatory", profile: str = "assets/cdc25_profile_mono.xml"
+    constraint: tuple = ("Mandatory",), profile: str = "assets/cdc25_profile_mono.xml"
 ) -> None:
     """
     Saves a json to the local filesystem
@@ -71,7 +54,7 @@ def main(args) -> None:
         "-c",
         "--constraint",
         action="append",
-        default="Mandatory",
+        choices=["Mandatory", "Recommended", "Optional"],
         help="Mandatory, recommended, optional constraint level",
     )
     p.add_argument(
@@ -80,8 +63,8 @@ def main(args) -> None:
         default="assets/cdc25_profile_mono.xml",
         help="The location of the file to parse",
     )
-    args = p.parse_args()
-    gen_rules_defaults(constraint=args.constraint, profile=args.profile)
+    args = p.parse_args(args)
+    gen_rules_defaults(constraint=args.constraint or ["Mandatory"], profile=args.profile)
 
 
 if __name__ == "__main__":
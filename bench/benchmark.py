@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+
+import argparse
+import copy
+import json
+import logging
+import multiprocessing
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+
+from lxml import etree
+
+root = Path(__file__).parent.parent
+sys.path.insert(0, str(root / "app"))
+
+import main as proxy  # noqa: E402
+
+TEMPLATE = root / "tests/example.xml"
+DDI = "{ddi:codebook:2_5}"
+
+# Outcomes that mean the proxy failed on a file of the corpus
+ERRORS = (proxy.SYNTAX_ERROR, proxy.XPATH_ERROR, proxy.WRITE_ERROR)
+
+
+def gen_var(i: int) -> etree._Element:
+    """
+    Returns a DDI var element with a label and a few categories.
+    """
+    var = etree.Element(DDI + "var", ID=f"V{i}", name=f"v{i}", intrvl="discrete")
+    etree.SubElement(var, DDI + "labl").text = f"Synthetic variable {i}"
+    for value, label in enumerate(["Yes", "No", "Don't know", "No answer"], 1):
+        catgry = etree.SubElement(var, DDI + "catgry")
+        etree.SubElement(catgry, DDI + "catValu").text = str(value)
+        etree.SubElement(catgry, DDI + "labl").text = label
+    return var
+
+
+def gen_codebook(
+    template: etree._ElementTree, rules: list, variables: int, missing: float, rng: random.Random
+) -> bytes:
+    """
+    Returns a synthetic export based on the template.
+
+    Parameters:
+    template (ElementTree): parsed export used as base
+    rules (list): compiled rules, their elements or attributes may be removed
+    variables (int): number of var elements in dataDscr
+    missing (float): share of rules whose element or attribute is removed
+    rng (Random): source of randomness, seeded for reproducible corpora
+    """
+
+    xml = copy.deepcopy(template)
+
+    # Remove elements and attributes the rules will have to add again
+    for rule in rules:
+        if rng.random() >= missing:
+            continue
+        for el in rule.find(xml):
+            if rule.is_attribute():
+                el.attrib.pop(rule.qname, None)
+            elif el.getparent() is not None:
+                el.getparent().remove(el)
+
+    # Variable level metadata, placed before otherMat as in DDI-Codebook
+    codebook = xml.find(f".//{DDI}codeBook")
+    data = etree.Element(DDI + "dataDscr")
+    for i in range(variables):
+        data.append(gen_var(i))
+    other = codebook.find(DDI + "otherMat")
+    if other is not None:
+        other.addprevious(data)
+    else:
+        codebook.append(data)
+
+    return etree.tostring(xml, encoding="utf-8")
+
+
+def gen_corpus(
+    directory: Path, files: int, variables: int, missing: float, seed: int = 0
+) -> list:
+    """
+    Writes a synthetic corpus in Dataverse's storage layout and
+    returns the paths of the exports.
+    """
+
+    rng = random.Random(seed)
+    rules = proxy.load_rules(proxy.DEFAULTS)
+    template = etree.parse(str(TEMPLATE), parser=proxy.XML_PARSER)
+
+    paths = []
+    for i in range(files):
+        path = directory / "files" / "10.5072" / f"BENCH{i:06d}" / proxy.EXPORT
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(gen_codebook(template, rules, variables, missing, rng))
+        paths.append(path)
+    return paths
+
+
+def percentile(values: list, p: float) -> float:
+    """
+    Nearest-rank percentile of a list of values.
+    """
+    values = sorted(values)
+    k = max(0, min(len(values) - 1, round(p / 100 * len(values)) - 1))
+    return values[k]
+
+
+def throughput(seconds: float, files: int, size: int) -> dict:
+    return {
+        "files": files,
+        "bytes": size,
+        "seconds": round(seconds, 4),
+        "files_per_s": round(files / seconds, 2) if seconds else None,
+        "mb_per_s": round(size / 1e6 / seconds, 2) if seconds else None,
+    }
+
+
+def bench_format_metadata(paths: list) -> dict:
+    """
+    Times format_metadata on every file of the corpus.
+    """
+
+    rules = proxy.load_rules(proxy.DEFAULTS)
+    size = sum(p.stat().st_size for p in paths)
+    latencies = []
+    outcomes = Counter()
+    start = time.perf_counter()
+    for path in paths:
+        t = time.perf_counter()
+        outcomes[proxy.format_metadata(str(path), rules).outcome] += 1
+        latencies.append(time.perf_counter() - t)
+    result = throughput(time.perf_counter() - start, len(paths), size)
+    result["outcomes"] = dict(outcomes)
+    result["unparseable"] = unparseable(paths)
+    result["p50_ms"] = round(percentile(latencies, 50) * 1000, 3)
+    result["p95_ms"] = round(percentile(latencies, 95) * 1000, 3)
+    return result
+
+
+def bench_main(directory: Path, workers: int) -> dict:
+    """
+    Times a full run of main() over the corpus. The transform cache is
+    disabled, so that every run transforms every file, and originals go
+    to an archive next to the corpus instead of the production one.
+    """
+
+    paths = list(proxy.find_exports(directory))
+    size = sum(p.stat().st_size for p in paths)
+    proxy.METADATA_ROOT = directory
+    proxy.LOG = directory / "proxy.log"
+    state = directory / "state.json"
+    archive = directory / "originals.sqlite"
+    summary = directory / "summary.json"
+    start = time.perf_counter()
+    proxy.main(
+        [
+            "--full",
+            "--state",
+            str(state),
+            "--workers",
+            str(workers),
+            "--transform-cache-mb",
+            "0",
+            "--archive",
+            str(archive),
+            "--summary",
+            str(summary),
+        ]
+    )
+    result = throughput(time.perf_counter() - start, len(paths), size)
+    with open(summary, encoding="utf-8") as f:
+        result["outcomes"] = json.load(f)["files"]
+    result["unparseable"] = unparseable(paths)
+    return result
+
+
+def unparseable(paths: list) -> int:
+    """
+    Number of exports a plain XML parser cannot read after the proxy
+    wrote them.
+    """
+
+    failed = 0
+    for path in paths:
+        try:
+            etree.parse(str(path))
+        except etree.XMLSyntaxError:
+            failed += 1
+    return failed
+
+
+def errors(result: dict) -> int:
+    return sum(result["outcomes"].get(o, 0) for o in ERRORS) + result["unparseable"]
+
+
+def peak_rss_mb(who: int) -> float:
+    # ru_maxrss is in kilobytes on Linux
+    return round(resource.getrusage(who).ru_maxrss / 1024, 1)
+
+
+def measured(f, *args):
+    """
+    Runs f(*args) in a child process, so that the peak RSS of each
+    phase is its own. Returns the result of f, the peak RSS in MB of
+    the child and of the worker processes it started.
+    """
+
+    def target(conn):
+        result = f(*args)
+        conn.send((result, peak_rss_mb(resource.RUSAGE_SELF), peak_rss_mb(resource.RUSAGE_CHILDREN)))
+        conn.close()
+
+    ctx = multiprocessing.get_context("fork")
+    receiver, sender = ctx.Pipe(duplex=False)
+    child = ctx.Process(target=target, args=(sender,))
+    child.start()
+    sender.close()
+    try:
+        result = receiver.recv()
+    except EOFError:
+        result = None
+    child.join()
+    if result is None or child.exitcode != 0:
+        raise RuntimeError(f"{f.__name__} failed with exit code {child.exitcode}")
+    return result
+
+
+def main(args) -> None:
+    p = argparse.ArgumentParser(
+        description="Measures proxy throughput on a synthetic corpus of exports"
+    )
+    p.add_argument("-f", "--files", type=int, default=100, help="Number of exports")
+    p.add_argument(
+        "-v", "--variables", type=int, default=500, help="Number of var elements per export"
+    )
+    p.add_argument(
+        "-m",
+        "--missing",
+        type=float,
+        default=0.2,
+        help="Share of rules whose element or attribute is missing",
+    )
+    p.add_argument("-w", "--workers", type=int, default=1, help="Workers for main()")
+    p.add_argument("-s", "--seed", type=int, default=0, help="Seed of the corpus")
+    p.add_argument("-o", "--output", help="Write results as json to this file")
+    p.add_argument("--keep", help="Keep the generated corpus in this folder")
+    args = p.parse_args(args)
+
+    # Only warnings and errors are logged, to a file next to the corpus
+    logging.disable(logging.INFO)
+
+    tmp = Path(args.keep or tempfile.mkdtemp(prefix="proxy-bench-"))
+    pristine, work = tmp / "pristine", tmp / "work"
+    try:
+        # Every phase runs in its own process, corpus generation holds
+        # the trees of all files
+        t = time.perf_counter()
+        paths, generate_rss, _ = measured(
+            gen_corpus, pristine, args.files, args.variables, args.missing, args.seed
+        )
+        generated = time.perf_counter() - t
+
+        # Every phase starts from the untouched corpus
+        shutil.rmtree(work, ignore_errors=True)
+        shutil.copytree(pristine, work)
+        format_metadata, format_metadata_rss, _ = measured(
+            bench_format_metadata, [work / p.relative_to(pristine) for p in paths]
+        )
+        shutil.rmtree(work)
+        shutil.copytree(pristine, work)
+        run, main_rss, workers_rss = measured(bench_main, work, args.workers)
+    finally:
+        if not args.keep:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    results = {
+        "config": vars(args),
+        "generate_seconds": round(generated, 4),
+        "format_metadata": format_metadata,
+        "main": run,
+        "peak_rss_mb": {
+            "generate": generate_rss,
+            "format_metadata": format_metadata_rss,
+            "main": main_rss,
+            "main_workers": workers_rss if args.workers > 1 else None,
+        },
+    }
+    out = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(out)
+    print(out)
+
+    failed = {phase: errors(results[phase]) for phase in ("format_metadata", "main")}
+    if any(failed.values()):
+        sys.exit(
+            "Failed files, the results are not comparable: "
+            + ", ".join(f"{phase} {n}" for phase, n in failed.items())
+        )
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
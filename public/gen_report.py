@@ -2,8 +2,14 @@
 
 import json
 import datetime
+import html
+import sys
+from pathlib import Path
 
-from lxml import etree
+root = Path(__file__).parent.parent
+sys.path.insert(0, str(root / "app"))
+
+import ddi_profile  # noqa: E402
 
 # Assume run from root directory
 
@@ -80,6 +86,9 @@ def write_body_start():
 def table_row(
     xpath: str, value: str, constraint: str, ui_label: str, ctype: str, notes: str
 ):
+    xpath, value, constraint, ui_label, ctype, notes = (
+        html.escape(str(v), quote=False) for v in (xpath, value, constraint, ui_label, ctype, notes)
+    )
     return f"""<tr>
         <td class="wrap">{xpath}</td>
         <td>{value}</td>
@@ -91,25 +100,19 @@ def table_row(
     """
 
 
-def write_table(j, l):
-    # Iterate over config and profile info
-    table = ""
+def write_table(j, profile):
+    # Yields a row per config entry that is part of the profile
     for k, v in j.items():
-        for x in l:
-            if x["xpath"] == k:
-                constraint = x["Required"] if "Required" in x else "n/a"
-                ui_label = x["CDC UI Label"] if "CDC UI Label" in x else "n/a"
-                ctype = x["ElementType"] if "ElementType" in x else "n/a"
-                notes = x["Usage"] if "Usage" in x else "n/a"
-                table += table_row(
-                    xpath=k,
-                    value=v,
-                    constraint=constraint,
-                    ui_label=ui_label,
-                    ctype=ctype,
-                    notes=notes,
-                )
-    return table
+        x = profile.get(k)
+        if x is not None:
+            yield table_row(
+                xpath=k,
+                value=v,
+                constraint=x["constraint"],
+                ui_label=x["ui_label"],
+                ctype=x["type"],
+                notes=x["usage"],
+            )
 
 
 def write_body_end():
@@ -122,42 +125,18 @@ def write_body_end():
 
 
 def main():
-    # Parse file as xml
-    xml_parser = etree.XMLParser(
-        remove_blank_text=True,
-        remove_comments=True,
-        load_dtd=True,
-        attribute_defaults=True,
-        ns_clean=True,
-    )
-
-    # CESSDA DDI profile
-    profile = etree.parse(PROFILE, parser=xml_parser)
-    profile_nsmap = profile.getroot().nsmap
-    profile_rules = profile.findall("//pr:Used", namespaces=profile_nsmap)
-
-    # Get rules, description and other info from profle
-    l = []
-    for rule in profile_rules:
-        d = {}
-        d["xpath"] = rule.values()[0]
-        descr = rule.getchildren()[0]
-        for field in descr.itertext():
-            if ": " in field:
-                key, val = field.split(": ", 1)
-                val = val.replace("\n                ", " ")
-                d[key] = val
-        l.append(d)
+    # CESSDA DDI profile, indexed by xpath
+    profile = ddi_profile.load(PROFILE)
 
     # Get proxy's config
-    with open(DEFAULTS, "r") as f:
+    with open(DEFAULTS, "r", encoding="utf-8") as f:
         j = json.load(f)
 
-    # Create html page
-    with open(REPORT, "w") as f:
+    # Create html page, row by row
+    with open(REPORT, "w", encoding="utf-8") as f:
         f.write(write_head())
         f.write(write_body_start())
-        f.write(write_table(j, l))
+        f.writelines(write_table(j, profile))
         f.write(write_body_end())
 
 
@@ -0,0 +1,26 @@
+import sys
+
+from pathlib import Path
+
+import pytest
+
+root = Path(__file__).parent.parent
+sys.path.insert(0, str(root / "app"))
+
+import main  # noqa: E402
+
+EXAMPLE = root / "tests/example.xml"
+
+
+@pytest.fixture(autouse=True)
+def log(tmp_path, monkeypatch):
+    """Runs of main log to a temporary file instead of proxy.log"""
+    filename = tmp_path / "proxy.log"
+    monkeypatch.setattr(main, "LOG", filename)
+    return filename
+
+
+@pytest.fixture
+def example():
+    """The GetRecord response of a single oai_ddi record"""
+    return EXAMPLE.read_bytes()
@@ -0,0 +1,59 @@
+import pytest
+
+import budget as budget_module
+import main
+import stream
+from budget import MB, Budget
+
+
+@pytest.fixture(scope="module")
+def configs():
+    return {main.OAI_DDI.name: main.load_config(main.OAI_DDI)}
+
+
+@pytest.fixture
+def reads(monkeypatch):
+    """Records the exports main reads, as a whole or streamed"""
+    reads = []
+
+    def opened(filename, *args, **kwargs):
+        reads.append(str(filename))
+        return open(filename, *args, **kwargs)
+
+    def split(filename, tags):
+        reads.append(str(filename))
+        return stream.split(filename, tags)
+
+    monkeypatch.setattr(main, "open", opened, raising=False)
+    monkeypatch.setattr(main, "split", split)
+    return reads
+
+
+@pytest.mark.parametrize("streamed", [False, True])
+@pytest.mark.parametrize("io", [main.NO_IO, main.IO(2, 4, 1)])
+def test_large_exports_are_not_read(example, tmp_path, configs, reads, streamed, io):
+    small = tmp_path / "small" / main.EXPORT
+    large = tmp_path / "large" / main.EXPORT
+    for export, size in ((small, len(example)), (large, 4 * len(example))):
+        export.parent.mkdir()
+        export.write_bytes(example * (size // len(example)))
+
+    budget = Budget(max_mb=2 * len(example) / MB)
+    options = main.Options(stream=streamed, io=io, budget=budget)
+    results = list(main.process_files([small, large], configs, options=options))
+
+    assert [r.outcome for r in results] == [main.CHANGED, main.OVER_BUDGET]
+    assert str(large) not in reads
+
+
+def test_memory_is_not_read_after_every_rule(example, tmp_path, configs, monkeypatch):
+    reads = []
+    rss = budget_module.rss
+    monkeypatch.setattr(budget_module, "rss", lambda: reads.append(1) or rss())
+    export = tmp_path / main.EXPORT
+    export.write_bytes(example)
+
+    options = main.Options(budget=Budget(seconds=60, memory_mb=1024))
+    assert main.format_metadata(str(export), configs[main.OAI_DDI.name].rules, options).outcome == main.CHANGED
+    # At the start, after parsing, the rules and serializing
+    assert len(reads) == 4
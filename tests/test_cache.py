@@ -0,0 +1,96 @@
+import os
+
+import pytest
+
+import main
+from cache import TransformCache
+from metrics import Metrics
+
+RULES = main.load_rules()
+
+
+@pytest.fixture
+def metrics(monkeypatch):
+    metrics = Metrics()
+    monkeypatch.setattr(main, "METRICS", metrics)
+    return metrics
+
+
+@pytest.fixture
+def export(example, tmp_path):
+    filename = tmp_path / main.EXPORT
+    filename.write_bytes(example)
+    return filename
+
+
+def lookups(metrics):
+    return {
+        dict(labels)["result"]: v
+        for (name, labels), v in metrics.counters.items()
+        if name == "transform_cache_total"
+    }
+
+
+def transform(export, cache):
+    return main.format_metadata(str(export), RULES, main.Options(cache=cache))
+
+
+def test_reexported_file_is_served_from_the_cache(export, example, tmp_path, metrics, monkeypatch):
+    cache = TransformCache(tmp_path / "transforms.sqlite", 1 << 20, "v1")
+    first = transform(export, cache)
+    fixed = export.read_bytes()
+
+    # Dataverse exports the same content again, it is not parsed
+    export.write_bytes(example)
+    monkeypatch.setattr(main.etree, "fromstring", lambda *a, **kw: pytest.fail("parsed"))
+    second = transform(export, cache)
+    assert export.read_bytes() == fixed
+    assert second == first
+    assert lookups(metrics) == {"miss": 1, "hit": 1}
+
+
+def test_new_version_misses(export, example, tmp_path, metrics):
+    filename = tmp_path / "transforms.sqlite"
+    transform(export, TransformCache(filename, 1 << 20, "v1"))
+    export.write_bytes(example)
+    assert transform(export, TransformCache(filename, 1 << 20, "v2")).outcome == main.CHANGED
+    assert lookups(metrics) == {"miss": 2}
+
+
+def test_version_follows_rules_and_code(tmp_path, monkeypatch):
+    configs = {main.OAI_DDI.name: main.load_config(main.OAI_DDI)}
+    version = main.transform_version(configs)
+    assert main.transform_version(configs) == version
+
+    with monkeypatch.context() as m:
+        m.setattr(main, "rules_hash", lambda configs: "edited")
+        assert main.transform_version(configs) != version
+
+    # The same rules with a changed module of the proxy
+    app = tmp_path / "app"
+    app.mkdir()
+    for source in main.root.joinpath("app").glob("*.py"):
+        (app / source.name).write_bytes(source.read_bytes())
+    monkeypatch.setattr(main, "__file__", str(app / "main.py"))
+    assert main.transform_version(configs) == version
+    with open(app / "writer.py", "a", encoding="utf-8") as f:
+        f.write("# changed\n")
+    assert main.transform_version(configs) != version
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = TransformCache(tmp_path / "transforms.sqlite", 10_000)
+    meta = {"fired": [], "violations": None}
+    for i in range(30):
+        cache.put(f"k{i}", os.urandom(1000), meta)  # does not compress
+        if i >= 1:
+            assert cache.get("k0") is not None  # used again and again
+        assert cache.size() <= cache.max_bytes
+
+    assert cache.get("k0") is not None
+    assert cache.get("k1") is None
+    assert cache.get("k29") is not None
+    # A new process starts from the size on disk
+    other = TransformCache(cache.filename, cache.max_bytes)
+    other.connect()
+    assert 0 < other.total <= other.max_bytes
@@ -0,0 +1,48 @@
+import pytest
+
+from country_codes import ISO3166, normalize, resolve
+
+
+@pytest.mark.parametrize(
+    "name, code",
+    [
+        ("Austria", "AT"),
+        ("Korea, Republic of", "KR"),
+        # Case, whitespace and punctuation
+        ("  AUSTRIA ", "AT"),
+        ("Korea Republic Of", "KR"),
+        # Diacritics and ß, in both spellings
+        ("Côte D'ivoire", "CI"),
+        ("Cote d Ivoire", "CI"),
+        ("Österreich", "AT"),
+        ("Osterreich", "AT"),
+        ("Großbritannien", "GB"),
+        ("Grossbritannien", "GB"),
+        # Aliases, and names without their remark
+        ("Czechia", "CZ"),
+        ("UK", "GB"),
+        ("Burma", "BU"),
+    ],
+)
+def test_names_are_resolved(name, code):
+    assert resolve(name) == code
+
+
+def test_close_misspellings_are_resolved():
+    assert resolve("Germny") == "DE"
+    assert resolve("Autria") == "AT"
+
+
+@pytest.mark.parametrize("name", ["Autsria", "Narnia", "", "  ", "-", None])
+def test_unknown_names_are_not_resolved(name):
+    # Below the fuzzy cutoff, or nothing to match
+    assert resolve(name) is None
+
+
+def test_every_name_of_the_table_resolves_to_its_code():
+    assert {name: resolve(name) for name in ISO3166} == ISO3166
+
+
+def test_normalize():
+    assert normalize("Côte D'ivoire") == "cote d ivoire"
+    assert normalize("  Bosnia_and   Herzegovina ") == "bosnia and herzegovina"
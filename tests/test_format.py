@@ -0,0 +1,46 @@
+import pytest
+
+from lxml import etree
+
+import main
+
+RULES = main.load_rules()
+
+
+def remove(export, rule):
+    """Removes the element or attribute of a rule from an export"""
+    xml = etree.parse(str(export), parser=main.XML_PARSER)
+    for el in rule.find(xml):
+        if rule.is_attribute():
+            for name in [a for a in el.attrib if etree.QName(a).localname == rule.attrib]:
+                del el.attrib[name]
+        elif el.getparent() is not None:
+            el.getparent().remove(el)
+    export.write_bytes(etree.tostring(xml, encoding="utf-8"))
+
+
+@pytest.mark.parametrize("rule", RULES, ids=[r.rule for r in RULES])
+def test_written_exports_parse_again(example, tmp_path, rule):
+    export = tmp_path / main.EXPORT
+    export.write_bytes(example)
+    remove(export, rule)
+
+    assert main.format_metadata(str(export), RULES).outcome == main.CHANGED
+    # Parsed like the next run or a harvester would, without the proxy's parser
+    xml = etree.parse(str(export))
+    assert len(rule.find(xml)) > 0
+    assert main.format_metadata(str(export), RULES).outcome == main.UNCHANGED
+
+
+def test_attribute_is_not_taken_for_a_longer_one(example, tmp_path):
+    """A concept with only @vocabURI still gets @vocab"""
+    export = tmp_path / main.EXPORT
+    export.write_bytes(example)
+
+    transformed = main.format_metadata(str(export), RULES)
+    assert "/codeBook/stdyDscr/method/dataColl/sampProc/concept/@vocab" in transformed.fired
+    violations = [v.xpath for v in transformed.violations]
+    assert "/codeBook/stdyDscr/method/dataColl/sampProc/concept/@vocab" not in violations
+    concepts = etree.parse(str(export)).iter("{ddi:codebook:2_5}concept")
+    sampling = [c.get("vocab") for c in concepts if c.getparent().tag.endswith("sampProc")]
+    assert sampling == ["Unavailable.", "Unavailable.", "DDI Sampling Procedure"]
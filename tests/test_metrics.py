@@ -0,0 +1,39 @@
+import pytest
+
+from lxml import etree
+
+import main
+from metrics import Metrics
+
+RULES = main.load_rules()
+
+
+@pytest.fixture
+def metrics(monkeypatch):
+    metrics = Metrics()
+    monkeypatch.setattr(main, "METRICS", metrics)
+    return metrics
+
+
+def apply_rules(example):
+    xml = etree.fromstring(example, parser=main.XML_PARSER).getroottree()
+    return main.apply_rules(xml, RULES)
+
+
+def timed(metrics):
+    return {name for name, _ in metrics.histograms}
+
+
+def test_rules_are_counted_but_not_timed(example, metrics):
+    fired = apply_rules(example)
+    assert metrics.counters[("rules_applied_total", ())] == len(RULES)
+    assert sum(v for (n, _), v in metrics.counters.items() if n == "rules_fired_total") == len(fired)
+    assert timed(metrics) == set()
+
+
+def test_detailed_metrics_time_rules_and_hooks(example, metrics):
+    metrics.detailed = True
+    apply_rules(example)
+    assert timed(metrics) == {"rule_seconds", "hook_seconds"}
+    rules = {dict(labels)["rule"] for name, labels in metrics.histograms if name == "rule_seconds"}
+    assert rules == {r.rule for r in RULES}
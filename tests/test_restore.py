@@ -0,0 +1,123 @@
+import re
+
+import pytest
+
+import archive as archive_module
+import main
+from archive import Archive
+
+
+@pytest.fixture
+def tree(example, tmp_path, monkeypatch):
+    """Three dataset folders with exports the rules change"""
+    monkeypatch.setattr(main, "METADATA_ROOT", tmp_path)
+    data = re.sub(rb"<nation\b.*?</nation>", b"", example, flags=re.S)
+    exports = []
+    for name in ("A", "B", "C"):
+        export = tmp_path / "files" / "10.5072" / name / main.EXPORT
+        export.parent.mkdir(parents=True)
+        export.write_bytes(data)
+        exports.append(export)
+    return exports
+
+
+def args(tmp_path, *extra):
+    return [
+        "--state",
+        str(tmp_path / "state.json"),
+        "--archive",
+        str(tmp_path / "originals.sqlite"),
+        "--transform-cache-mb",
+        "0",
+        "--formats",
+        "oai_ddi",
+        *extra,
+    ]
+
+
+def test_restore_writes_originals_back(tree, tmp_path, capsys):
+    originals = [e.read_bytes() for e in tree]
+    main.main(args(tmp_path))
+    assert all(e.read_bytes() != o for e, o in zip(tree, originals))
+
+    main.main(args(tmp_path, "--restore", "--dry-run"))
+    assert "Would restore 3 files, skipped 0" in capsys.readouterr().out
+    assert all(e.read_bytes() != o for e, o in zip(tree, originals))
+
+    main.main(args(tmp_path, "--restore"))
+    assert "Restored 3 files, skipped 0" in capsys.readouterr().out
+    assert [e.read_bytes() for e in tree] == originals
+
+    # Restored before, nothing left to do
+    main.main(args(tmp_path, "--restore"))
+    assert "Restored 0 files, skipped 0" in capsys.readouterr().out
+
+
+def test_files_changed_since_are_not_restored(tree, tmp_path):
+    main.main(args(tmp_path))
+    tree[0].write_bytes(b"<codeBook>written by Dataverse</codeBook>")
+
+    restored, skipped = main.restore(Archive(tmp_path / "originals.sqlite"))
+    assert (restored, skipped) == (2, 1)
+    assert tree[0].read_bytes() == b"<codeBook>written by Dataverse</codeBook>"
+
+
+def test_restore_a_run_or_a_dataset(tree, tmp_path, example):
+    main.main(args(tmp_path))
+    archive = Archive(tmp_path / "originals.sqlite")
+    first = archive.runs()[-1][0]
+    fixed = tree[0].read_bytes()
+
+    # Dataverse exports B again, the next run fixes it
+    tree[1].write_bytes(example.replace(b">Austria</nation>", b">Czechia</nation>"))
+    rewritten = tree[1].read_bytes()
+    main.main(args(tmp_path))
+    assert [files for _, files, _ in archive.runs()] == [3, 1]
+
+    # Undoing the second run brings back Dataverse's second export
+    assert main.restore(archive, archive.runs()[-1][0]) == (1, 0)
+    assert tree[1].read_bytes() == rewritten
+
+    # By default the last version Dataverse wrote is restored, here of one dataset
+    main.main(args(tmp_path))
+    assert main.restore(archive, folder=main.dataset_folder("10.5072/B")) == (1, 0)
+    assert tree[1].read_bytes() == rewritten
+    assert tree[0].read_bytes() == fixed
+
+    # The first run's original of B changed since, so it is left alone
+    assert main.restore(archive, first) == (2, 1)
+
+
+def test_restore_a_dataset_of_a_run(tree, tmp_path, capsys):
+    originals = [e.read_bytes() for e in tree]
+    main.main(args(tmp_path))
+    run = Archive(tmp_path / "originals.sqlite").runs()[-1][0]
+
+    dataset = ["--run", run, "--dataset", "10.5072/B"]
+    main.main(args(tmp_path, "--restore", "--dry-run", *dataset))
+    assert "Would restore 1 files, skipped 0" in capsys.readouterr().out
+    main.main(args(tmp_path, "--restore", *dataset))
+    assert [e.read_bytes() == o for e, o in zip(tree, originals)] == [False, True, False]
+
+
+def test_originals_are_stored_and_compressed_once(tree, tmp_path, monkeypatch):
+    compressed = []
+    compress = archive_module.zlib.compress
+
+    def counted(data, level=-1):
+        compressed.append(len(data))
+        return compress(data, level)
+
+    monkeypatch.setattr(archive_module.zlib, "compress", counted)
+    main.main(args(tmp_path))
+    # The three exports have the same content
+    assert len(compressed) == 1
+    archive = Archive(tmp_path / "originals.sqlite")
+    assert archive.connect().execute("SELECT COUNT(*) FROM blobs").fetchone() == (1,)
+
+
+def test_streamed_original_is_archived(tree, tmp_path):
+    archive = Archive(tmp_path / "originals.sqlite")
+    original = tree[0].read_bytes()
+    archive.add(tree[0])
+    assert archive.read(archive.pending[str(tree[0])]) == original
@@ -0,0 +1,40 @@
+import json
+
+import pytest
+
+import main
+from config import ConfigError
+
+
+@pytest.fixture
+def hooks(tmp_path):
+    """Writes the hooks file with extra declarations, returns its path"""
+
+    def write(extra):
+        with open(main.HOOKS, encoding="utf-8") as f:
+            data = json.load(f)
+        filename = tmp_path / "hooks.json"
+        filename.write_text(json.dumps({**data, **extra}), encoding="utf-8")
+        return filename
+
+    return write
+
+
+def test_hooks_are_attached_to_their_rules(hooks):
+    rules = {r.rule: [name for name, _ in r.hooks] for r in main.load_rules(hooks=hooks({}))}
+    assert rules["/codeBook/stdyDscr/stdyInfo/sumDscr/nation/@abbr"] == ["nation_abbr"]
+    assert rules["/codeBook/stdyDscr/stdyInfo/subject/keyword"] == ["drop_social_sciences"]
+
+
+@pytest.mark.parametrize(
+    "extra, error",
+    [
+        ({"/codeBook/stdyDscr/stdyInfo/sumDscr/nation": "nation_abbr"}, "nation_abbr is an attribute hook"),
+        ({"/codeBook/@xml:lang": ["gfk_lang", "drop_social_sciences"]}, "is an element hook"),
+        ({"/codeBook/stdyDscr/citation/notInDefaults/@x": "force"}, "not in the defaults"),
+        ({"/codeBook/@xml:lang": "unknown"}, "unknown hook"),
+    ],
+)
+def test_invalid_hooks_are_rejected(hooks, extra, error):
+    with pytest.raises(ConfigError, match=error):
+        main.load_rules(hooks=hooks(extra))
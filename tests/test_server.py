@@ -0,0 +1,166 @@
+import asyncio
+import copy
+import threading
+import urllib.request
+
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.error import HTTPError
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+from lxml import etree
+
+import main
+from server import DDI, OAI, Proxy
+
+IDENTIFY = b'<OAI-PMH xmlns="http://www.openarchives.org/OAI/2.0/"><Identify/></OAI-PMH>'
+
+# ------------------------------------------------------------------------- #
+# Stand-in OAI server and proxy
+# ------------------------------------------------------------------------- #
+
+
+def list_records(example, records=3):
+    """A ListRecords page with copies of the record of the example"""
+    doc = etree.fromstring(example)
+    record = doc.find(f"{OAI}GetRecord/{OAI}record")
+    page = etree.SubElement(doc, OAI + "ListRecords")
+    for i in range(records):
+        r = copy.deepcopy(record)
+        r.find(f"{OAI}header/{OAI}identifier").text = f"doi:10.5072/TEST{i}"
+        page.append(r)
+    doc.remove(doc.find(OAI + "GetRecord"))
+    return etree.tostring(doc, encoding="utf-8")
+
+
+@pytest.fixture
+def upstream(example):
+    """Serves the example like Dataverse's OAI endpoint, yields its URL"""
+    responses = {"GetRecord": example, "ListRecords": list_records(example), "Identify": IDENTIFY}
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            query = parse_qs(urlsplit(self.path).query)
+            body = responses.get(query.get("verb", [""])[0], b"<not-xml")
+            if "broken" in query.get("set", []):
+                body = b"<not-xml"
+            self.send_response(200)
+            self.send_header("Content-Type", "text/xml")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/oai"
+    server.shutdown()
+    server.server_close()
+
+
+@contextmanager
+def running(proxy):
+    """Runs the proxy on a free port in a thread, yields its URL"""
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    start = asyncio.start_server(proxy.handle, "127.0.0.1", 0)
+    server = asyncio.run_coroutine_threadsafe(start, loop).result(timeout=10)
+    try:
+        yield f"http://127.0.0.1:{server.sockets[0].getsockname()[1]}/oai"
+    finally:
+        loop.call_soon_threadsafe(server.close)
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(timeout=10)
+        loop.close()
+
+
+@pytest.fixture(scope="module")
+def rules():
+    return main.load_rules()
+
+
+def get(url, data=None, timeout=10):
+    with urllib.request.urlopen(url, data=data, timeout=timeout) as r:
+        return r.read()
+
+
+def codebooks(body):
+    doc = etree.fromstring(body, parser=etree.XMLParser(remove_blank_text=True))
+    return list(doc.iter(DDI + "codeBook"))
+
+
+# ------------------------------------------------------------------------- #
+# Tests
+# ------------------------------------------------------------------------- #
+
+
+def test_get_record_matches_fixed_export(upstream, rules, example, tmp_path):
+    export = tmp_path / main.EXPORT
+    export.write_bytes(example)
+    main.format_metadata(str(export), rules)
+    expected = etree.tostring(codebooks(export.read_bytes())[0])
+
+    proxy = Proxy(upstream, lambda xml: main.apply_rules(xml, rules))
+    with running(proxy) as url:
+        body = get(url + "?verb=GetRecord&metadataPrefix=oai_ddi&identifier=doi:10.11587/P5YJ0O")
+    assert [etree.tostring(c) for c in codebooks(body)] == [expected]
+
+
+def test_list_records_fixes_every_record_and_caches_them(upstream, rules):
+    proxy = Proxy(upstream, lambda xml: main.apply_rules(xml, rules))
+    with running(proxy) as url:
+        first = get(url + "?verb=ListRecords&metadataPrefix=oai_ddi")
+        second = get(url + "?verb=ListRecords&metadataPrefix=oai_ddi")
+    nations = [n.get("abbr") for c in codebooks(first) for n in c.iter(DDI + "nation")]
+    assert nations == ["AT", "AT", "AT"]
+    assert first == second
+    assert (proxy.cache.misses, proxy.cache.hits) == (3, 3)
+
+
+def test_post_query_is_fixed(upstream, rules):
+    proxy = Proxy(upstream, lambda xml: main.apply_rules(xml, rules))
+    with running(proxy) as url:
+        body = get(url, data=b"verb=GetRecord&metadataPrefix=oai_ddi&identifier=x")
+    assert [n.get("abbr") for n in codebooks(body)[0].iter(DDI + "nation")] == ["AT"]
+
+
+def test_other_verbs_and_broken_responses_pass_through(upstream, rules):
+    proxy = Proxy(upstream, lambda xml: main.apply_rules(xml, rules))
+    with running(proxy) as url:
+        assert get(url + "?verb=Identify") == IDENTIFY
+        assert get(url + "?verb=ListRecords&set=broken") == b"<not-xml"
+        assert get(url + "?verb=ListIdentifiers") == b"<not-xml"
+
+
+def test_unavailable_upstream(rules):
+    proxy = Proxy("http://127.0.0.1:9/oai", lambda xml: main.apply_rules(xml, rules), timeout=2)
+    with running(proxy) as url:
+        with pytest.raises(HTTPError) as e:
+            get(url + "?verb=Identify")
+    assert e.value.code == 502
+
+
+def test_transform_does_not_block_other_connections(upstream):
+    """A page that takes long to transform leaves the event loop free"""
+    entered, release = threading.Event(), threading.Event()
+
+    def slow(xml):
+        entered.set()
+        release.wait(timeout=10)
+
+    proxy = Proxy(upstream, slow)
+    with running(proxy) as url:
+        harvest = threading.Thread(target=get, args=(url + "?verb=ListRecords",))
+        harvest.start()
+        try:
+            assert entered.wait(timeout=10)
+            assert get(url + "?verb=Identify", timeout=5) == IDENTIFY
+        finally:
+            release.set()
+            harvest.join()
@@ -0,0 +1,47 @@
+from pathlib import Path
+
+import pytest
+
+import main
+
+FOLDERS = [f"files/10.5072/FK2/{i:06d}" for i in range(200)]
+
+
+def exports(top, names=(main.EXPORT,)):
+    return [Path(top) / folder / name for folder in FOLDERS for name in names]
+
+
+def test_shards_are_disjoint_and_complete():
+    files = exports(main.METADATA_ROOT)
+    shards = [list(main.sharded(files, (i, 4))) for i in range(1, 5)]
+    assert sorted(f for shard in shards for f in shard) == sorted(files)
+    assert all(shard for shard in shards)
+    assert list(main.sharded(files, None)) == files
+
+
+def test_exports_of_a_dataset_share_a_shard():
+    names = [f.export for f in main.FORMATS.values()]
+    for folder in FOLDERS[:20]:
+        files = [main.METADATA_ROOT / folder / name for name in names]
+        assert len({main.shard_of(f, 4) for f in files}) == 1
+
+
+def test_shard_does_not_depend_on_the_mount_point(monkeypatch):
+    here = [main.shard_of(f, 4) for f in exports(main.METADATA_ROOT)]
+    monkeypatch.setattr(main, "METADATA_ROOT", Path("/mnt/dataverse"))
+    assert [main.shard_of(f, 4) for f in exports("/mnt/dataverse")] == here
+
+
+@pytest.mark.parametrize(
+    "dataset, shards, shard", [("A", 4, 1), ("B", 4, 3), ("C", 4, 3), ("A", 7, 5), ("C", 7, 7)]
+)
+def test_shard_is_stable(dataset, shards, shard):
+    """Pinned, so that a new version does not move datasets between hosts"""
+    export = main.METADATA_ROOT / "files/10.5072" / dataset / main.EXPORT
+    assert main.shard_of(export, shards) == shard
+
+
+@pytest.mark.parametrize("value", ["0/4", "5/4", "4", "a/b"])
+def test_invalid_shards_are_rejected(value):
+    with pytest.raises(main.argparse.ArgumentTypeError):
+        main.shard_spec(value)
@@ -0,0 +1,58 @@
+import os
+
+import pytest
+
+import main
+from state import Manifest
+
+
+@pytest.fixture(scope="module")
+def configs():
+    return {main.OAI_DDI.name: main.load_config(main.OAI_DDI)}
+
+
+@pytest.fixture
+def export(example, tmp_path):
+    filename = tmp_path / main.EXPORT
+    filename.write_bytes(example)
+    return filename
+
+
+def run(export, configs, state, rules_hash=None, full=False):
+    """One run over the export, returns the number of files per outcome"""
+    manifest = Manifest(state, rules_hash or main.rules_hash(configs))
+    return main.run([export], configs, manifest, full=full)
+
+
+def test_unchanged_files_are_skipped(export, configs, tmp_path):
+    state = tmp_path / "state.json"
+    assert run(export, configs, state) == {main.CHANGED: 1}
+    assert run(export, configs, state) == {main.SKIPPED: 1}
+    # Processed again, but the rules have nothing left to do
+    assert run(export, configs, state, full=True) == {main.UNCHANGED: 1}
+
+
+def test_touched_files_are_compared_by_content(export, configs, tmp_path):
+    state = tmp_path / "state.json"
+    run(export, configs, state)
+    st = export.stat()
+    os.utime(export, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    assert run(export, configs, state) == {main.SKIPPED: 1}
+
+    # Exported again by Dataverse
+    export.write_bytes(export.read_bytes().replace(b' abbr="AT"', b""))
+    assert run(export, configs, state) == {main.CHANGED: 1}
+
+
+def test_changed_rules_process_all_files(export, configs, tmp_path):
+    state = tmp_path / "state.json"
+    run(export, configs, state)
+    assert run(export, configs, state, rules_hash="edited") == {main.UNCHANGED: 1}
+
+
+def test_removed_files_are_skipped(export, configs, tmp_path):
+    state = tmp_path / "state.json"
+    run(export, configs, state)
+    export.unlink()
+    assert run(export, configs, state) == {main.SKIPPED: 1}
+    assert not Manifest(state, main.rules_hash(configs)).files
@@ -0,0 +1,75 @@
+import pytest
+
+from lxml import etree
+
+import main
+from stream import SECTIONS, join, split, streamable
+
+STREAM = main.Options(stream=True)
+
+# Sections with formatting the parser would not keep: CDATA, entities,
+# attribute spacing and blank lines
+FILE_DSCR = b'<fileDscr ID="f1">\n  <fileTxt><fileName>a &amp; b.tab</fileName></fileTxt>\n</fileDscr>'
+DATA_DSCR = (
+    b'<dataDscr>\n\n<var ID="V1"   name="v1"><labl><![CDATA[<b>Age</b>]]></labl>'
+    b"<catgry><catValu>1</catValu></catgry></var>\n  </dataDscr>"
+)
+
+
+@pytest.fixture
+def export(example, tmp_path):
+    """The example with fileDscr and dataDscr sections before otherMat"""
+    i = example.index(b"<otherMat")
+    data = example[:i] + FILE_DSCR + b"\n  " + DATA_DSCR + b"\n  " + example[i:]
+    filename = tmp_path / main.EXPORT
+    filename.write_bytes(data)
+    return filename
+
+
+@pytest.fixture(scope="module")
+def rules():
+    return main.load_rules()
+
+
+def canonical(filename):
+    parser = etree.XMLParser(remove_blank_text=True)
+    return etree.tostring(etree.parse(str(filename), parser), method="c14n")
+
+
+def test_split_leaves_out_sections(export):
+    original = export.read_bytes()
+    raw, ranges = split(export, SECTIONS)
+    assert [original[start:end] for start, end in ranges] == [FILE_DSCR, DATA_DSCR]
+    assert b"<dataDscr" not in raw and b"<fileDscr" not in raw
+    assert b"".join(join(raw, export, ranges)) == original
+
+
+def test_split_without_sections(export):
+    raw, ranges = split(export, ["nonexistent"])
+    assert (raw, ranges) == (export.read_bytes(), [])
+
+
+def test_streamed_export_matches_parsed_one(export, rules, tmp_path):
+    parsed = tmp_path / "parsed" / main.EXPORT
+    parsed.parent.mkdir()
+    parsed.write_bytes(export.read_bytes())
+
+    assert main.format_metadata(str(parsed), rules).outcome == main.CHANGED
+    assert main.format_metadata(str(export), rules, STREAM).outcome == main.CHANGED
+    assert canonical(export) == canonical(parsed)
+    # Copied through byte for byte, not serialized again
+    streamed = export.read_bytes()
+    assert FILE_DSCR in streamed and DATA_DSCR in streamed
+
+
+def test_section_in_comment_is_processed_as_whole(export, rules):
+    data = export.read_bytes().replace(b"<stdyDscr>", b"<stdyDscr><!-- <dataDscr>old</dataDscr> -->", 1)
+    export.write_bytes(data)
+    assert main.format_metadata(str(export), rules, STREAM).outcome == main.CHANGED
+    assert b"<!-- <dataDscr>old</dataDscr> -->" not in export.read_bytes()  # comments are dropped
+    assert export.read_bytes().count(b"<dataDscr>") == 1
+
+
+def test_sections_with_rules_are_parsed():
+    rules = ["/codeBook/stdyDscr/citation", "/codeBook/dataDscr/var/@name"]
+    assert streamable(rules) == ["fileDscr"]
@@ -0,0 +1,46 @@
+import os
+
+import pytest
+
+import main
+
+
+@pytest.fixture
+def share(tmp_path):
+    """A files/ folder on a share linked into the metadata root"""
+    share = tmp_path / "share"
+    for name in ("A", "B"):
+        export = share / "10.5072" / name / main.EXPORT
+        export.parent.mkdir(parents=True)
+        export.write_bytes(b"<codeBook/>")
+    root = tmp_path / "data"
+    root.mkdir()
+    (root / main.FILES_DIR).symlink_to(share)
+    return root
+
+
+def test_linked_files_folder_is_walked(share):
+    exports = sorted(p.relative_to(share).as_posix() for p in main.find_exports(share))
+    assert exports == [f"files/10.5072/{name}/{main.EXPORT}" for name in ("A", "B")]
+
+
+def test_links_back_up_the_tree_do_not_loop(share):
+    files = share / main.FILES_DIR
+    (files / "10.5072" / "A" / "up").symlink_to(files)
+    (files / "10.5072" / "B" / "parent").symlink_to(files / "10.5072")
+    (files / "10.5072" / "B" / "gone").symlink_to(share / "nonexistent")
+    exports = [p.relative_to(share).as_posix() for p in main.find_exports(share)]
+    assert sorted(exports) == [f"files/10.5072/{name}/{main.EXPORT}" for name in ("A", "B")]
+
+
+def test_only_the_root_and_links_are_stated(share, monkeypatch):
+    stats = []
+    stat = os.stat
+
+    def counted(path, *args, **kwargs):
+        stats.append(str(path))
+        return stat(path, *args, **kwargs)
+
+    monkeypatch.setattr(main.os, "stat", counted)
+    assert len(list(main.find_exports(share))) == 2
+    assert stats == [str(share)]